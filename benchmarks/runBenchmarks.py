@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Microbenchmarks of bot hot paths: envelope parsing, command dispatch, RPC request building and
+signal-cli call round trips (subprocess, HTTP jsonRPC and stdio jsonRPC) against local stubs.
+
+Results (throughput and latency percentiles) are printed and saved as JSON, so runs can be compared:
+
+    python benchmarks/runBenchmarks.py --output before.json
+    python benchmarks/runBenchmarks.py --output after.json --compare before.json
+
+Stubs answer at once - round trips show bot side cost (process start, HTTP, pipes), not signal-cli itself.
+Settings come from config.py_template (not your config.py), so runs on different machines are comparable.
+"""
+
+import argparse
+import datetime
+import importlib.machinery
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+_benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+_repo_dir = os.path.dirname(_benchmarks_dir)
+_fixture = os.path.join(_benchmarks_dir, 'fixtures', 'envelopes.jsonl')
+_stub_signal_cli = os.path.join(_benchmarks_dir, 'stubSignalCli.py')
+
+
+def _load_config():
+    """Use config.py_template as config module and point signal-cli to stub. Must run before bot imports"""
+    spec = importlib.util.spec_from_loader(
+        'config', importlib.machinery.SourceFileLoader('config', os.path.join(_repo_dir, 'config.py_template')))
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    config.SIGNAL_CMD_PATH = _stub_signal_cli
+    config.ALLOWED_END_USERS = []
+    sys.modules['config'] = config
+    return config
+
+
+sys.path.insert(0, _repo_dir)
+config = _load_config()
+
+import common  # noqa: E402
+from commandRouter import CommandRouter  # noqa: E402
+from jsonrpcclient import request  # noqa: E402
+from signalBot import SignalBot  # noqa: E402
+from signalHandler import SignalHandler, SignalRPCHandler, SignalStdioHandler  # noqa: E402
+from stubRpcServer import StubRpcServer  # noqa: E402
+
+
+class Benchmark:
+    """Function measured by BenchmarkRunner
+
+        items - how many things (envelopes, messages) one call handles; throughput is also given per item
+        setup/teardown - called once around measurement (e.g. to start stub server)
+    """
+
+    def __init__(self, name, function, items=1, setup=None, teardown=None):
+        self.name = name
+        self.function = function
+        self.items = items
+        self.setup = setup
+        self.teardown = teardown
+
+
+class BenchmarkRunner:
+    """Run each benchmark for at least min_time seconds and min_samples samples
+
+        Fast functions are called many times per sample (so timer cost does not count), slow ones once.
+        Percentiles are of time per call.
+    """
+    _sample_target = 0.001
+    _warmup_time = 0.1
+
+    def __init__(self, min_time=1.0, min_samples=20):
+        self._min_time = min_time
+        self._min_samples = min_samples
+
+    def run(self, benchmark):
+        if benchmark.setup is not None:
+            benchmark.setup()
+        try:
+            return self._measure(benchmark)
+        finally:
+            if benchmark.teardown is not None:
+                benchmark.teardown()
+
+    def _measure(self, benchmark):
+        function = benchmark.function
+        warmup_end = time.perf_counter() + self._warmup_time
+        calls = 0
+        start = time.perf_counter()
+        while calls == 0 or time.perf_counter() < warmup_end:
+            function()
+            calls += 1
+        per_call = (time.perf_counter() - start) / calls
+        number = max(1, int(self._sample_target / per_call)) if per_call > 0 else 1000
+
+        samples = []
+        end = time.perf_counter() + self._min_time
+        while len(samples) < self._min_samples or time.perf_counter() < end:
+            start = time.perf_counter()
+            for _ in range(number):
+                function()
+            samples.append((time.perf_counter() - start) / number)
+        return self._get_result(benchmark, samples, number)
+
+    def _get_result(self, benchmark, samples, number):
+        total = sum(samples) * number
+        calls = len(samples) * number
+        if len(samples) > 1:
+            q = statistics.quantiles(samples, n=100, method='inclusive')
+            p50, p90, p99 = q[49], q[89], q[98]
+        else:
+            p50 = p90 = p99 = samples[0]
+        return {
+            'name': benchmark.name,
+            'calls': calls,
+            'calls_per_sample': number,
+            'items_per_call': benchmark.items,
+            'ops_per_sec': calls / total,
+            'items_per_sec': calls * benchmark.items / total,
+            'mean_us': total / calls * 1e6,
+            'min_us': min(samples) * 1e6,
+            'p50_us': p50 * 1e6,
+            'p90_us': p90 * 1e6,
+            'p99_us': p99 * 1e6,
+            'max_us': max(samples) * 1e6,
+        }
+
+
+def _load_envelopes():
+    with open(_fixture, 'rb') as f:
+        return [line.rstrip(b'\n') for line in f if line.strip()]
+
+
+def _get_benchmarks():
+    """Return all benchmarks. Objects are created here, so only selected ones pay for their setup"""
+    lines = _load_envelopes()
+    envelopes = [json.loads(line) for line in lines]
+    cli = SignalHandler()
+    messages = cli._parse_messages(lines)
+    bodies = [m for m in messages if m.get_message_body() is not None]
+
+    # Bot without its workers, stores and server - only command router is needed. Handlers do nothing
+    bot = SignalBot.__new__(SignalBot)
+    bot._router = CommandRouter()
+    bot._register_commands()
+    for command in bot._router._commands:
+        command.handler = lambda message: None
+
+    rpc = SignalRPCHandler()
+    stdio = SignalStdioHandler(receive_messages=False)
+    servers = []
+    message = messages[0]
+    recipient = message.get_source_account()
+    # The same list as _build_params converts for send with quote and attachment
+    message_args = [rpc._cmd_send_message_param_recipient] + rpc._message_args(
+        recipient, 'Pong', message.get_timestamp(), ['/tmp/a.jpg'])[1]
+    rpc_calls = [rpc._receipt_args(message, 'read'), rpc._reaction_args(message, '👍'),
+                 rpc._message_args(recipient, 'Pong', message.get_timestamp(), [])]
+
+    def parse_messages():
+        cli._parse_messages(lines)
+
+    def parse_message_json():
+        for e in envelopes:
+            cli._parse_message_json(e)
+
+    def dispatch():
+        for m in bodies:
+            bot._find_known_message_body_pattern(m)
+
+    def convert_list_to_dict():
+        common.convert_list_to_dict(message_args)
+
+    def rpc_build_request():
+        for command, args in rpc_calls:
+            request(command, rpc._build_params(command, list(args)))
+
+    def cli_call():
+        cli._call(*cli._message_args(recipient, 'Pong', None, []))
+
+    def rpc_call():
+        rpc._call(*rpc._message_args(recipient, 'Pong', None, []))
+
+    def rpc_batch():
+        with rpc.batch() as b:
+            for _ in range(10):
+                b.send_message(recipient, 'Pong')
+
+    def stdio_call():
+        stdio._call(*stdio._message_args(recipient, 'Pong', None, []))
+
+    def start_server():
+        servers.append(StubRpcServer().__enter__())
+        config.SIGNALRPC_POST_ENDPOINT = servers[-1].endpoint
+
+    def stop_server():
+        servers.pop().__exit__(None, None, None)
+
+    return [
+        Benchmark('parse_messages', parse_messages, items=len(lines)),
+        Benchmark('parse_message_json', parse_message_json, items=len(envelopes)),
+        Benchmark('dispatch', dispatch, items=len(bodies)),
+        Benchmark('convert_list_to_dict', convert_list_to_dict),
+        Benchmark('rpc_build_request', rpc_build_request, items=len(rpc_calls)),
+        Benchmark('cli_call', cli_call),
+        Benchmark('rpc_call', rpc_call, setup=start_server, teardown=stop_server),
+        Benchmark('rpc_batch', rpc_batch, items=10, setup=start_server, teardown=stop_server),
+        Benchmark('stdio_call', stdio_call, teardown=stdio.close),
+    ]
+
+
+def _get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=_repo_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_result(result, previous=None):
+    line = (f'{result["name"]:<22} {result["ops_per_sec"]:>12,.1f} ops/s {result["items_per_sec"]:>12,.1f} items/s'
+            f'  p50 {result["p50_us"]:>10.2f}us  p90 {result["p90_us"]:>10.2f}us  p99 {result["p99_us"]:>10.2f}us')
+    if previous is not None:
+        line += f'  p50 {(result["p50_us"] / previous["p50_us"] - 1) * 100:+.1f}% vs previous'
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', metavar='FILE',
+                        help='Save results as JSON (default benchmarks/results/<date>.json)')
+    parser.add_argument('--compare', metavar='FILE', help='Show p50 change against results saved earlier')
+    parser.add_argument('--only', metavar='NAME', action='append',
+                        help='Run only benchmarks with this name (can be repeated)')
+    parser.add_argument('--min-time', type=float, default=1.0, help='Seconds to measure each benchmark')
+    parser.add_argument('--min-samples', type=int, default=20, help='Minimal number of samples per benchmark')
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare, encoding='utf8') as f:
+            previous = {r['name']: r for r in json.load(f)['benchmarks']}
+
+    benchmarks = _get_benchmarks()
+    if args.only:
+        unknown = set(args.only) - {b.name for b in benchmarks}
+        if unknown:
+            parser.error(f'Unknown benchmarks: {", ".join(sorted(unknown))}')
+        benchmarks = [b for b in benchmarks if b.name in args.only]
+
+    runner = BenchmarkRunner(args.min_time, args.min_samples)
+    results = []
+    for b in benchmarks:
+        result = runner.run(b)
+        results.append(result)
+        _print_result(result, previous.get(b.name))
+
+    output = args.output
+    if output is None:
+        output = os.path.join(_benchmarks_dir, 'results', datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf8') as f:
+        json.dump({
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'git_commit': _get_git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'min_time': args.min_time,
+            'benchmarks': results,
+        }, f, indent=2)
+    print(f'Results saved in {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Fake signal-cli HTTP jsonRPC daemon for benchmarks - answers at once with keep-alive connections"""
+
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from stubSignalCli import get_rpc_response
+
+
+class _StubRpcRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately - without it every response waits for delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        body = json.dumps(get_rpc_response(req)).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubRpcServer:
+    """Serve jsonRPC endpoint on random localhost port in background thread. Use as context manager"""
+    path = '/api/v1/rpc'
+
+    def __init__(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StubRpcRequestHandler)
+        self._server.daemon_threads = True
+        self.endpoint = f'http://127.0.0.1:{self._server.server_address[1]}{self.path}'
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, name='stubRpcServer', daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Fake signal-cli for benchmarks - answers at once, so only bot side of a call is measured
+
+    stubSignalCli.py -o json receive [...]   prints envelopes from fixtures/envelopes.jsonl
+    stubSignalCli.py -o json send [...]      prints successful send result (also sendReceipt, sendReaction)
+    stubSignalCli.py jsonRpc [...]           answers jsonRPC requests (single and batch) read from stdin
+"""
+
+import json
+import os
+import sys
+import time
+
+_fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'envelopes.jsonl')
+_account = '+48500100200'
+
+
+def get_rpc_result(method, params):
+    """Return result signal-cli gives for successful call"""
+    recipient = (params or {}).get('recipient', _account)
+    return {'results': [{'recipientAddress': {'number': recipient}, 'type': 'SUCCESS'}],
+            'timestamp': int(time.time() * 1000)}
+
+
+def get_rpc_response(req):
+    """Return jsonRPC response for request (dict) or batch (list of dicts)"""
+    if isinstance(req, list):
+        return [get_rpc_response(r) for r in req]
+    return {'jsonrpc': '2.0', 'result': get_rpc_result(req.get('method'), req.get('params')), 'id': req.get('id')}
+
+
+def _run_json_rpc():
+    for line in sys.stdin:
+        if line.strip():
+            sys.stdout.write(json.dumps(get_rpc_response(json.loads(line))) + '\n')
+            sys.stdout.flush()
+
+
+def main(args):
+    # Global options (-o json, -a ACCOUNT) come before command
+    while args and args[0].startswith('-'):
+        args = args[2:]
+    command = args[0] if args else None
+    if command == 'jsonRpc':
+        _run_json_rpc()
+    elif command == 'receive':
+        with open(_fixture, encoding='utf8') as f:
+            sys.stdout.write(f.read())
+    elif command in ('send', 'sendReceipt', 'sendReaction'):
+        print(json.dumps(get_rpc_result(command, {'recipient': args[1] if len(args) > 1 else _account})))
+    else:
+        print(f'stubSignalCli: unknown command {command}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
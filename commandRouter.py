@@ -0,0 +1,105 @@
+import logging
+
+import metrics
+import tracing
+
+import re
+
+
+class Command:
+    """Single command registered in CommandRouter"""
+
+    def __init__(self, name, handler, usage, help_text):
+        self.name = name
+        self.handler = handler
+        self.usage = usage
+        self.help_text = help_text
+
+    def __str__(self) -> str:
+        return f'{self.usage} - {self.help_text}'
+
+
+class CommandRouter:
+    """Find handler for message body in one pass
+
+        Command can be registered with:
+        keyword - whole message must be this word (case insensitive, surrounding whitespaces ignored)
+        pattern - regexp searched anywhere in message
+
+        Keywords are looked up in dict. All patterns are compiled into one alternation, so finding a command
+        costs one dict lookup and one regexp search no matter how many commands there are.
+        If more patterns match, the one that matches earliest in message wins (then the first registered).
+        Patterns must not use numbered backreferences as their groups are renumbered in alternation.
+    """
+
+    def __init__(self):
+        self._commands = []
+        self._keywords = {}
+        self._pattern_commands = {}
+        self._pattern_parts = []
+        self._pattern = None
+
+    def register(self, name, handler, keyword=None, pattern=None, flags=0, usage=None, help_text=''):
+        """Register handler(message) for messages with given keyword or matching pattern"""
+        if (keyword is None) == (pattern is None):
+            raise RuntimeError(f'Command {name} needs exactly one of keyword or pattern')
+        if usage is None:
+            usage = f'"{keyword.capitalize()}"' if keyword is not None else name
+        command = Command(name, handler, usage, help_text)
+
+        if keyword is not None:
+            keyword = keyword.lower()
+            if keyword in self._keywords:
+                raise RuntimeError(f'Keyword {keyword} is already registered')
+            self._keywords[keyword] = command
+        else:
+            group = f'_cmd{len(self._pattern_parts)}'
+            # Check pattern alone first, so error points to the broken one
+            re.compile(pattern, flags)
+            self._pattern_parts.append(f'(?P<{group}>{self._scoped_flags(flags, pattern)})')
+            self._pattern_commands[group] = command
+            self._pattern = None
+        self._commands.append(command)
+        return command
+
+    def find(self, body):
+        """Return Command for given message body or None"""
+        command = self._keywords.get(body.strip().lower())
+        if command is not None:
+            return command
+        if not self._pattern_parts:
+            return None
+        if self._pattern is None:
+            self._pattern = re.compile('|'.join(self._pattern_parts))
+        m = self._pattern.search(body)
+        if m is None:
+            return None
+        return self._pattern_commands[m.lastgroup]
+
+    def dispatch(self, message) -> bool:
+        """Call handler of command found in message. Return False if no command was found"""
+        with tracing.span('dispatch') as span:
+            command = self.find(message.get_message_body())
+            span.set_attribute('command', command.name if command is not None else 'unknown')
+        if command is None:
+            return False
+        logging.debug(f'CommandRouter - message {message.get_timestamp()} is {command.name} command')
+        metrics.inc('commands', command=command.name)
+        with metrics.timer('command_seconds', command=command.name), tracing.span('handler', command=command.name):
+            command.handler(message)
+        return True
+
+    def get_help(self) -> str:
+        """Return help lines for all registered commands"""
+        return '\n'.join(str(c) for c in self._commands)
+
+    def _scoped_flags(self, flags, pattern):
+        """Return pattern wrapped in group with inline flags like (?i:...) so they apply to it only"""
+        letters = ''
+        if flags & re.IGNORECASE:
+            letters += 'i'
+        if flags & re.MULTILINE:
+            letters += 'm'
+        if flags & re.DOTALL:
+            letters += 's'
+        return f'(?{letters}:{pattern})' if letters else pattern
@@ -31,7 +31,8 @@ def init_webdriver():
     options.add_argument('--ash-no-nudges')
     options.add_argument('--disable-search-engine-choice-screen')
     options.add_argument('--disable-gpu')
-    options.add_argument('--remote-debugging-port=9222')
+    # Port 0 - Chrome picks free port, so more browsers can run at the same time
+    options.add_argument('--remote-debugging-port=0')
 
     # bypass headless check
     user_agent = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/60.0.3112.50 Safari/537.36'
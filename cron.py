@@ -4,6 +4,10 @@ import argparse
 import os
 
 from crontab import CronTab
+from cronSchedule import get_scheduled_jobs
+
+# Daemon is started again within this time if it died (entry runs often, but lock lets only one daemon run)
+DAEMON_WATCHDOG_EXPRESSION = '*/5 * * * *'
 
 
 def main():
@@ -12,36 +16,39 @@ def main():
     parser = argparse.ArgumentParser(description=desc, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('--rpc', action='store_true',
                         help='If set the signalRPCBOT version will be used (instead of signalBOT)')
+    parser.add_argument('--stdio', action='store_true',
+                        help='If set the signalStdioBOT version will be used (instead of signalBOT)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='If set signalScheduledBot runs in daemon mode (instead of entry per job). It is started '
+                             'after reboot and by watchdog entry if it is not running')
 
     args = parser.parse_args()
     is_rpc = args.rpc
+    is_stdio = args.stdio
+    is_daemon = args.daemon
 
     cron = CronTab(user=True)
-
+    path = os.path.abspath('./signalScheduledBot.py')
+    command = 'python3 ' + "'" + path + "'"
     if is_rpc:
-        path = os.path.abspath('./signalScheduledBot.py')
-
-        # Unread messages
-        job_um = cron.new(command='python3 ' + "'" + path + "' --rpc --unread_messages")
-        job_um.setall('15,45 6-20 * * *')
-
-        # Schedule
-        job_schedule_morning = cron.new(command='python3 ' + "'" + path + "' --rpc --this_week_schedule")
-        job_schedule_morning.setall('0 8 * * MON-FRI')
-        job_schedule_afternoon = cron.new(command='python3 ' + "'" + path + "' --rpc --this_week_schedule")
-        job_schedule_afternoon.setall('30 19 * * MON-THU')
-        job_schedule_sunday = cron.new(command='python3 ' + "'" + path + "' --rpc --next_week_schedule")
-        job_schedule_sunday.setall('30 19 * * SUN')
-
-        cron.write()
+        command += ' --rpc'
+    if is_stdio:
+        command += ' --stdio'
+
+    if is_daemon:
+        # One process runs all jobs on their schedule. flock -n exits at once if daemon holds the lock already
+        lock_path = os.path.abspath('./signalScheduledBot.lock')
+        command = 'flock -n ' + "'" + lock_path + "' " + command + ' --daemon'
+        job_daemon = cron.new(command=command)
+        job_daemon.every_reboot()
+        job_watchdog = cron.new(command=command)
+        job_watchdog.setall(DAEMON_WATCHDOG_EXPRESSION)
     else:
-        path = os.path.abspath('./signalScheduledBot.py')
-
-        # Unread messages
-        job_um = cron.new(command='python3 ' + "'" + path + "' --unread_messages")
-        job_um.setall('30 6-20 * * *')
+        for expression, option in get_scheduled_jobs(is_rpc or is_stdio):
+            job = cron.new(command=command + ' ' + option)
+            job.setall(expression)
 
-        cron.write()
+    cron.write()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,99 @@
+import datetime
+
+
+# Jobs of signalScheduledBot: (cron expression, signalScheduledBot option). Used by cron.py and --daemon mode
+SCHEDULED_JOBS = [
+    ('15,45 6-20 * * *', '--unread_messages'),
+    ('0 8 * * MON-FRI', '--this_week_schedule'),
+    ('30 19 * * MON-THU', '--this_week_schedule'),
+    ('30 19 * * SUN', '--next_week_schedule'),
+]
+# signalScheduledBot without jsonRPC is slow - only unread messages are checked, less often
+SCHEDULED_JOBS_NO_RPC = [
+    ('30 6-20 * * *', '--unread_messages'),
+]
+
+
+def get_scheduled_jobs(is_rpc):
+    return SCHEDULED_JOBS if is_rpc else SCHEDULED_JOBS_NO_RPC
+
+
+class CronSchedule:
+    """Standard 5 field cron expression (minute hour day-of-month month day-of-week)
+
+        Supports *, lists, ranges, steps and names (JAN-DEC, SUN-SAT). As in cron, if both day of month and
+        day of week are restricted, day matching any of them matches.
+    """
+    _fields = (
+        ('minute', 0, 59, ()),
+        ('hour', 0, 23, ()),
+        ('day of month', 1, 31, ()),
+        ('month', 1, 12, ('JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC')),
+        ('day of week', 0, 7, ('SUN', 'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT')),
+    )
+    # Longest time to look for next run - enough for expressions like Feb 29 on Monday
+    _max_search_days = 366 * 28
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != len(self._fields):
+            raise ValueError(f'Cron expression "{expression}" must have {len(self._fields)} fields')
+        values = [self._parse_field(p, *f) for p, f in zip(parts, self._fields)]
+        self._minutes, self._hours, self._days, self._months, weekdays = values
+        # 7 is Sunday too
+        self._weekdays = {d % 7 for d in weekdays}
+        self._days_restricted = parts[2] != '*'
+        self._weekdays_restricted = parts[4] != '*'
+
+    def __str__(self) -> str:
+        return self.expression
+
+    def get_next(self, after):
+        """Return first datetime (with whole minute) after given one matching expression"""
+        t = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        minutes = sorted(self._minutes)
+        hours = sorted(self._hours)
+        for _ in range(self._max_search_days):
+            if t.month in self._months and self._is_day_matching(t):
+                for h in hours:
+                    if h < t.hour:
+                        continue
+                    for m in minutes:
+                        if h == t.hour and m < t.minute:
+                            continue
+                        return t.replace(hour=h, minute=m)
+            t = (t + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+        raise ValueError(f'Cron expression "{self.expression}" never matches')
+
+    def _is_day_matching(self, t):
+        day = t.day in self._days
+        # datetime: Monday is 0, cron: Sunday is 0
+        weekday = (t.weekday() + 1) % 7 in self._weekdays
+        if self._days_restricted and self._weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    def _parse_field(self, text, name, minimum, maximum, names):
+        values = set()
+        for item in text.split(','):
+            value_range, _, step = item.partition('/')
+            try:
+                step = int(step) if step else 1
+                if value_range == '*':
+                    start, end = minimum, maximum
+                else:
+                    start, _, end = value_range.partition('-')
+                    start = self._parse_value(start, names, minimum)
+                    end = self._parse_value(end, names, minimum) if end else (maximum if item != value_range else start)
+            except ValueError:
+                raise ValueError(f'Wrong {name} "{item}" in cron expression "{self.expression}"')
+            if not minimum <= start <= end <= maximum or step < 1:
+                raise ValueError(f'Wrong {name} "{item}" in cron expression "{self.expression}"')
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _parse_value(self, text, names, minimum):
+        if text.upper() in names:
+            return names.index(text.upper()) + minimum
+        return int(text)
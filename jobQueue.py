@@ -0,0 +1,110 @@
+import logging
+
+import contextvars
+import queue
+import threading
+import time
+
+
+class JobQueueFullError(RuntimeError):
+    """Job cannot be queued because queue (or user's part of it) is full"""
+
+
+class Job:
+    """Single job in JobQueue"""
+    STATE_QUEUED = 'queued'
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+
+    def __init__(self, user, description, func, args):
+        self.user = user
+        self.description = description
+        self.state = self.STATE_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self._func = func
+        self._args = args
+        # Job runs in context of its submitter - e.g. it continues trace of message that queued it
+        self._context = contextvars.copy_context()
+
+    def __str__(self) -> str:
+        if self.state == self.STATE_RUNNING:
+            return f'{self.description} - {self.state} for {int(time.time() - self.started_at)}s'
+        return f'{self.description} - {self.state}'
+
+    def run(self):
+        self.state = self.STATE_RUNNING
+        self.started_at = time.time()
+        try:
+            self._context.run(self._func, *self._args)
+        except Exception:
+            self.state = self.STATE_FAILED
+            raise
+        self.state = self.STATE_DONE
+
+
+class JobQueue:
+    """Run long jobs in bounded pool of background worker threads
+
+        Number of waiting/running jobs is limited in total and per user, so one user cannot fill the queue.
+        Workers are started on first submit.
+    """
+
+    def __init__(self, name, workers=2, max_jobs=10, max_jobs_per_user=3):
+        self._name = name
+        self._workers = workers
+        self._max_jobs = max_jobs
+        self._max_jobs_per_user = max_jobs_per_user
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._jobs = []
+        self._threads = []
+
+    def submit(self, user, description, func, *args) -> Job:
+        """Queue func(*args) to be run by worker. Raise JobQueueFullError if limits are reached"""
+        with self._lock:
+            if len(self._jobs) >= self._max_jobs:
+                raise JobQueueFullError(f'Queue is full ({self._max_jobs} jobs). Try again later')
+            if len([j for j in self._jobs if j.user == user]) >= self._max_jobs_per_user:
+                raise JobQueueFullError(f'You already have {self._max_jobs_per_user} jobs in queue. '
+                                        'Wait until they are done')
+            job = Job(user, description, func, args)
+            self._jobs.append(job)
+            self._start_workers()
+        logging.info(f'JobQueue {self._name} - queued {description} for {user}')
+        self._queue.put(job)
+        return job
+
+    def get_jobs(self, user=None):
+        """Return waiting and running jobs (of given user only if set)"""
+        with self._lock:
+            return [j for j in self._jobs if user is None or j.user == user]
+
+    def get_waiting_count(self) -> int:
+        """Return number of jobs waiting for free worker"""
+        with self._lock:
+            return len([j for j in self._jobs if j.state == Job.STATE_QUEUED])
+
+    def _start_workers(self):
+        """Start worker threads if not running yet. Must be called with self._lock held"""
+        while len(self._threads) < self._workers:
+            t = threading.Thread(target=self._work, name=f'{self._name}-{len(self._threads)}', daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def _work(self):
+        """Worker loop - run queued jobs one by one"""
+        while True:
+            job = self._queue.get()
+            logging.info(f'JobQueue {self._name} - start {job.description} for {job.user}')
+            try:
+                job.run()
+            except Exception:
+                logging.error(f'JobQueue {self._name} - job {job.description} failed', exc_info=True)
+            else:
+                logging.info(f'JobQueue {self._name} - finished {job.description} in '
+                             f'{time.time() - job.started_at:.1f}s')
+            finally:
+                with self._lock:
+                    self._jobs.remove(job)
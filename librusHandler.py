@@ -2,20 +2,43 @@ import logging
 
 import common
 import config
+import tracing
+import webdriverPool
 
+import base64
+import datetime
+import json
 import os
+import re
+import time
 
+from contextlib import contextmanager
+
+from librusWebClient import LibrusWebClient, get_message_id
 from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support.select import Select
 from selenium.webdriver.support.wait import WebDriverWait
 
 
+def get_first_date(*texts):
+    """Return first ISO date (YYYY-MM-DD) found in texts (checked in given order) or None"""
+    for text in texts:
+        for match in re.finditer(r'(?<!\d)(\d{4})-(\d{2})-(\d{2})(?!\d)', text or ''):
+            try:
+                return datetime.date(*map(int, match.groups())).isoformat()
+            except ValueError:
+                continue
+    return None
+
+
 class LibrusHandler:
     """Handle connection and actions with Librus Synergia"""
     _librus_username = None
     _librus_password = None
 
-    _error_screenshot_filename = os.path.abspath('./error.png')
+    _screenshot_dir = os.path.abspath('.')
+    _error_screenshot_prefix = 'error'
 
     _cookie_button_class_name = 'modal-button__primary'
     _cookie_box_id = 'cookieBoxClose'
@@ -30,30 +53,156 @@ class LibrusHandler:
 
     _messages_table_line_class_name = 'line0'
     _messages_unread_xpath = '//td[@style="font-weight: bold;"]//a'
+    _messages_link_xpath = '//tr[contains(@class, "line")]/td//a[contains(@href, "/wiadomosci/")]'
     _message_view_sender_xpath = '//html//body//div[3]//div[3]//form//div//div//table//tbody//tr//td[2]//table[2]//tbody//tr[1]//td[2]'
     _message_view_topic_xpath = '//html//body//div[3]//div[3]//form//div//div//table//tbody//tr//td[2]//table[2]//tbody//tr[2]//td[2]'
     _message_view_body_xpath ='//html//body//div[3]//div[3]//form//div//div//table//tbody//tr//td[2]/div'
 
     _schedule_form_name = 'formPrzegladajPlan'
     _schedule_next_week_xpath='//html//body//div[1]//div//div//div//form//table[1]//tbody//tr[1]//th//a[2]//img'
-    _schedule_screenshot_filename = os.path.abspath('./schedule.png')
+    _schedule_week_select_name = 'tydzien'
+    _schedule_screenshot_prefix = 'schedule'
+    _schedule_screenshot_quality = getattr(config, 'LIBRUS_SCHEDULE_SCREENSHOT_QUALITY', 80)
+    # Position and size of element in page (not only in viewport), so it can be captured whole
+    _element_rect_script = ('const r = arguments[0].getBoundingClientRect();'
+                            'return [r.left + window.scrollX, r.top + window.scrollY,'
+                            ' Math.max(r.width, arguments[0].scrollWidth),'
+                            ' Math.max(r.height, arguments[0].scrollHeight)];')
+
+    _session_dir = getattr(config, 'LIBRUS_SESSION_DIR', os.path.abspath('./librusSessions'))
+    # Only these fields of cookies returned by Network.getAllCookies are accepted by Network.setCookies
+    _session_cookie_fields = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite', 'expires')
+
+    # Read messages with plain HTTP requests (browser is used only to log in)
+    _http_fetch = getattr(config, 'LIBRUS_HTTP_FETCH', False)
 
     _wait_timeout = 10
     _wait_poll_frequency = .2
+    _optional_element_timeout = 3
 
     driver = None
 
-    def __init__(self, username, password):
+    def __init__(self, username, password, timings=None):
+        """Log into Librus (or reuse saved session)
+
+            timings - optional list where (phase, seconds) of each step (login, messages list, ...) is appended
+        """
         self._librus_username = username
         self._librus_password = password
-        self.driver = common.init_webdriver()
-        self._log_into_librus()
+        self.timings = timings if timings is not None else []
+        # Files per account, so accounts can be handled in parallel
+        self._error_screenshot_filename = self.get_account_error_screenshot(username)
+        if os.path.exists(self._error_screenshot_filename):
+            # Screenshot left by previous run must not be sent as error of this one
+            os.remove(self._error_screenshot_filename)
+        self._logged_in = False
+        self._web_client = None
+        self.driver = webdriverPool.get_pool().acquire()
+        try:
+            with self._phase('login'):
+                if not self._restore_session():
+                    self._log_into_librus()
+        except BaseException:
+            webdriverPool.get_pool().release(self.driver)
+            raise
+        self._logged_in = True
+        self._save_session()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        common.destroy_webdriver(self.driver)
+        if self._web_client is not None:
+            self._web_client.close()
+        if self._logged_in:
+            # Librus may refresh cookies during the visit - keep the newest ones
+            self._save_session()
+        webdriverPool.get_pool().release(self.driver)
+
+    @classmethod
+    def get_account_error_screenshot(cls, username):
+        """Return path of error screenshot for given account (it exists only if error occurred)"""
+        return cls._get_account_filename(cls._error_screenshot_prefix, username)
+
+    @classmethod
+    def _get_account_filename(cls, prefix, username, extension='png'):
+        return os.path.join(cls._screenshot_dir, f'{prefix}_{cls._get_safe_username(username)}.{extension}')
+
+    @staticmethod
+    def _get_safe_username(username):
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', username)
+
+    @contextmanager
+    def _phase(self, name):
+        """Record duration of with block in self.timings (and as tracing span)"""
+        start = time.perf_counter()
+        try:
+            with tracing.span(f'librus_{name}'):
+                yield
+        finally:
+            self.timings.append((name, time.perf_counter() - start))
+
+    def _get_session_filename(self):
+        return os.path.join(self._session_dir, f'{self._get_safe_username(self._librus_username)}.json')
+
+    def _restore_session(self):
+        """Load cookies saved by previous run. Return True if they are still valid (user is logged)"""
+        try:
+            with open(self._get_session_filename(), encoding='utf8') as f:
+                cookies = json.load(f)
+        except FileNotFoundError:
+            logging.info('LibrusHandler - No saved session. Full login needed')
+            return False
+        except ValueError:
+            logging.warning('LibrusHandler - Saved session is broken. Full login needed')
+            return False
+
+        logging.info('LibrusHandler - Try to reuse saved session')
+        self.driver.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+        self.driver.get(config.LIBRUS_MESSAGES_PAGE)
+        try:
+            WebDriverWait(
+                self.driver,
+                timeout=self._optional_element_timeout,
+                poll_frequency=self._wait_poll_frequency,
+                ignored_exceptions=[NoSuchElementException]
+            ).until(lambda d: self.driver.find_element(By.ID, self._logged_user_id))
+        except TimeoutException:
+            logging.info('LibrusHandler - Saved session expired. Full login needed')
+            self.driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            return False
+        logging.info('LibrusHandler - Saved session is valid. Login skipped')
+        return True
+
+    def _save_session(self):
+        """Save all browser cookies, so next run does not need to log in"""
+        try:
+            cookies = self.driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']
+            cookies = [
+                {k: v for k, v in c.items() if k in self._session_cookie_fields and not (k == 'expires' and v < 0)}
+                for c in cookies
+            ]
+            os.makedirs(self._session_dir, mode=0o700, exist_ok=True)
+            filename = self._get_session_filename()
+            # Cookies are as good as password - readable only for owner
+            fd = os.open(filename + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'w', encoding='utf8') as f:
+                json.dump(cookies, f)
+            os.replace(filename + '.tmp', filename)
+        except Exception:
+            logging.warning('LibrusHandler - Cannot save session', exc_info=True)
+
+    def _close_cookie_box(self):
+        """Close cookie info box if it is shown (it is not when cookie consent was saved in session)"""
+        try:
+            WebDriverWait(
+                self.driver,
+                timeout=self._optional_element_timeout,
+                poll_frequency=self._wait_poll_frequency,
+                ignored_exceptions=[NoSuchElementException, StaleElementReferenceException]
+            ).until(lambda d: self.driver.find_element(By.ID, self._cookie_box_id).click() or True)
+        except TimeoutException:
+            logging.debug('LibrusHandler - No cookie box')
 
     def _log_into_librus(self):
         """Try to log into librusSynergia with given username/password"""
@@ -102,10 +251,25 @@ class LibrusHandler:
 
     def get_unread_messages(self):
         """Return all unread messages as dict"""
+        message_urls = [m['url'] for m in self.get_message_list() if m['unread']]
+        if not message_urls:
+            logging.info('LibrusHandler - No new messages')
+            return None
+        logging.info(f'LibrusHandler - Found {len(message_urls)} unread messages')
+        return [self.get_message(url) for url in message_urls]
+
+    def get_message_list(self):
+        """Return messages from first page of messages list as dicts with id, url and unread flag"""
+        with self._phase('message_list'):
+            return self._get_message_list()
+
+    def _get_message_list(self):
+        if self._http_fetch:
+            return self._get_web_client().get_message_list()
         try:
             expected_errors = [NoSuchElementException, StaleElementReferenceException]
 
-            logging.info('LibrusHandler - Get new messages from librusSynergia.')
+            logging.info('LibrusHandler - Get messages list from librusSynergia.')
             self.driver.get(config.LIBRUS_MESSAGES_PAGE)
             wait = WebDriverWait(
                 self.driver,
@@ -115,33 +279,46 @@ class LibrusHandler:
             )
             wait.until(lambda d: self.driver.find_element(By.ID, self._logged_user_id) or True)
             common.simulate_human_delay()
-            wait.until(lambda d: self.driver.find_element(By.ID, self._cookie_box_id).click() or True)
+            self._close_cookie_box()
 
             wait.until(lambda d: self.driver.find_elements(By.CLASS_NAME, self._messages_table_line_class_name) or True)
-            message_box = self.driver.find_element(By.XPATH, self._messages_unread_xpath)
-
-            unread_messages = []
-            try:
-                while True:
-                    unread_messages.append(self._get_message_data(message_box))
-                    self.driver.get(config.LIBRUS_MESSAGES_PAGE)
-                    common.simulate_human_delay()
-                    wait.until(lambda d: self.driver.find_elements(By.CLASS_NAME, self._messages_table_line_class_name) or True)
-                    message_box = self.driver.find_element(By.XPATH, self._messages_unread_xpath)
-            except NoSuchElementException as te:
-                # All messages were fetched
-                return unread_messages
+            # Read whole list at once and open messages directly - no list reload after each one
+            unread_links = self.driver.find_elements(By.XPATH, self._messages_unread_xpath)
+            unread_urls = {e.get_attribute('href') for e in unread_links}
+            # Sender and topic link to the same message
+            message_urls = dict.fromkeys(filter(None, (
+                e.get_attribute('href') for e in self.driver.find_elements(By.XPATH, self._messages_link_xpath)
+            )))
+            return [{'id': get_message_id(url), 'url': url, 'unread': url in unread_urls} for url in message_urls]
 
         except TimeoutException as te:
             logging.error('LibrusHandler - You are not logged. Cannot fetch messages')
             self.driver.save_screenshot(self._error_screenshot_filename)
             raise RuntimeError(te)
-        except NoSuchElementException as te:
-            logging.info('LibrusHandler - No new messages')
-            return None
+
+    def get_message(self, url):
+        """Open message (it is marked as read) and return it as dict with sender, topic and body"""
+        with self._phase('message'):
+            if self._http_fetch:
+                return self._get_web_client().get_message(url)
+            return self._get_message_data(url=url)
+
+    def _get_web_client(self):
+        """Return client reading pages without browser with session of this browser"""
+        if self._web_client is None:
+            self._web_client = LibrusWebClient.from_driver(self.driver)
+        return self._web_client
 
     def get_schedule(self, next_week=False):
         """Open schedule and return picture of it"""
+        return self.get_schedule_data(next_week)['file']
+
+    def get_schedule_data(self, next_week=False):
+        """Open schedule and return dict with its picture (file), text and first day of week (week)"""
+        with self._phase('schedule'):
+            return self._get_schedule_data(next_week)
+
+    def _get_schedule_data(self, next_week):
         try:
             expected_errors = [NoSuchElementException, StaleElementReferenceException]
 
@@ -158,16 +335,52 @@ class LibrusHandler:
                 wait.until(lambda d: self.driver.find_element(By.XPATH, self._schedule_next_week_xpath).click() or True)
                 common.simulate_human_delay()
 
-            wait.until(lambda d: self.driver.find_element(By.NAME, self._schedule_form_name) or True)
-            self.driver.save_screenshot(self._schedule_screenshot_filename)
+            schedule_form = wait.until(lambda d: self.driver.find_element(By.NAME, self._schedule_form_name))
+            text = schedule_form.text
+            week = self._get_schedule_week(schedule_form, text, next_week)
+            # One file per account - Outbox sends its own copy, so it can be overwritten by next schedule
+            filename = self._get_account_filename(self._schedule_screenshot_prefix, self._librus_username,
+                                                  extension='jpg')
+            self._save_element_screenshot(schedule_form, filename)
 
-            return self._schedule_screenshot_filename
+            return {'file': filename, 'text': text, 'week': week}
 
         except TimeoutException as te:
             logging.error('LibrusHandler - You are not logged. Cannot fetch schedule')
             self.driver.save_screenshot(self._error_screenshot_filename)
             raise RuntimeError(te)
 
+    def _get_schedule_week(self, schedule_form, text, next_week):
+        """Return first day (ISO date) of week shown in schedule - from week selector or the first date in schedule
+
+            Week computed from local date is used only if page has no date - it may differ from shown one
+            (e.g. Librus shows next week already on weekend).
+        """
+        texts = [text]
+        selects = schedule_form.find_elements(By.NAME, self._schedule_week_select_name)
+        if selects:
+            texts.insert(0, Select(selects[0]).first_selected_option.get_attribute('value'))
+        week = get_first_date(*texts)
+        if week is not None:
+            return week
+        logging.warning('LibrusHandler - Cannot find week in schedule page. Using week of local date')
+        week_start = datetime.date.today() - datetime.timedelta(days=datetime.date.today().weekday())
+        if next_week:
+            week_start += datetime.timedelta(weeks=1)
+        return week_start.isoformat()
+
+    def _save_element_screenshot(self, element, filename):
+        """Save JPEG picture of element only - whole, even if it does not fit in window"""
+        x, y, width, height = self.driver.execute_script(self._element_rect_script, element)
+        screenshot = self.driver.execute_cdp_cmd('Page.captureScreenshot', {
+            'format': 'jpeg',
+            'quality': self._schedule_screenshot_quality,
+            'clip': {'x': x, 'y': y, 'width': width, 'height': height, 'scale': 1},
+            'captureBeyondViewport': True,
+        })
+        with open(filename, 'wb') as f:
+            f.write(base64.b64decode(screenshot['data']))
+
     def get_error_screenshot(self):
         return self._error_screenshot_filename
 
@@ -0,0 +1,145 @@
+import logging
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+class LibrusIndex:
+    """Remember Librus messages seen per account and their delivery to each subscriber (and sent schedules)
+
+        Message is known by its id (see librusWebClient.get_message_id), so it is fetched only once,
+        no matter if it was read in browser in the meantime. Content hash lets skip copies of the same message.
+        Delivery is recorded per subscriber only after it was sent, so messages not delivered because of
+        failure are sent again in next run (for pending_retention_days) and delivered ones never again.
+        Messages (with their deliveries) and schedules older than retention_days are removed by prune.
+    """
+
+    def __init__(self, path, pending_retention_days=7, retention_days=30):
+        self._pending_retention = pending_retention_days * 24 * 60 * 60
+        self._retention = retention_days * 24 * 60 * 60
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS messages ('
+                           'account TEXT NOT NULL, message_id TEXT NOT NULL, content_hash TEXT, '
+                           'sender TEXT, topic TEXT, body TEXT, seen_at REAL NOT NULL, '
+                           'PRIMARY KEY (account, message_id))')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS deliveries ('
+                           'account TEXT NOT NULL, message_id TEXT NOT NULL, subscriber TEXT NOT NULL, '
+                           'delivered_at REAL, '
+                           'PRIMARY KEY (account, message_id, subscriber))')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS schedules ('
+                           'account TEXT NOT NULL, week TEXT NOT NULL, content_hash TEXT NOT NULL, '
+                           'text TEXT NOT NULL, sent_at REAL NOT NULL, '
+                           'PRIMARY KEY (account, week))')
+        self._conn.commit()
+
+    def get_message_ids(self, account):
+        """Return set of known message ids of account or None if account was never synced"""
+        with self._lock:
+            ids = {r[0] for r in self._conn.execute('SELECT message_id FROM messages WHERE account = ?', (account,))}
+        return ids or None
+
+    def add_seen(self, account, message_ids):
+        """Record messages that should not be forwarded (e.g. read ones found in first sync)"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany('INSERT OR IGNORE INTO messages (account, message_id, seen_at) VALUES (?, ?, ?)',
+                                   [(account, i, now) for i in message_ids])
+            self._conn.commit()
+
+    def add_message(self, account, message, subscribers) -> bool:
+        """Record fetched message (dict with id, sender, topic, body) to be delivered to subscribers
+
+            Return False if message is known already or it is a copy of known one (nothing to deliver).
+        """
+        content_hash = self._get_content_hash(message)
+        now = time.time()
+        with self._lock:
+            duplicate = self._conn.execute('SELECT message_id FROM messages WHERE account = ? AND content_hash = ?',
+                                           (account, content_hash)).fetchone()
+            cur = self._conn.execute(
+                'INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (account, message['id'], content_hash, message['sender'], message['topic'], message['body'], now)
+            )
+            if cur.rowcount == 0 or duplicate is not None:
+                self._conn.commit()
+                if duplicate is not None:
+                    logging.info(f'LibrusIndex - message {message["id"]} is copy of {duplicate[0]}. Skipped')
+                return False
+            self._conn.executemany('INSERT OR IGNORE INTO deliveries VALUES (?, ?, ?, NULL)',
+                                   [(account, message['id'], s) for s in subscribers])
+            self._conn.commit()
+        return True
+
+    def get_pending_deliveries(self, account, subscribers):
+        """Return list of (message dict, subscriber) not delivered yet to given subscribers, oldest message first"""
+        since = time.time() - self._pending_retention
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT m.message_id, m.sender, m.topic, m.body, d.subscriber FROM deliveries d '
+                'JOIN messages m ON m.account = d.account AND m.message_id = d.message_id '
+                'WHERE d.account = ? AND d.delivered_at IS NULL AND m.seen_at >= ? '
+                'ORDER BY m.seen_at, m.rowid', (account, since)
+            ).fetchall()
+        return [({'id': i, 'sender': sender, 'topic': topic, 'body': body}, subscriber)
+                for i, sender, topic, body, subscriber in rows if subscriber in subscribers]
+
+    def mark_delivered(self, account, message_id, subscriber):
+        with self._lock:
+            self._conn.execute('UPDATE deliveries SET delivered_at = ? '
+                               'WHERE account = ? AND message_id = ? AND subscriber = ?',
+                               (time.time(), account, message_id, subscriber))
+            self._conn.commit()
+
+    def get_schedule(self, account, week):
+        """Return text of schedule sent last time for given account and week or None"""
+        with self._lock:
+            row = self._conn.execute('SELECT text FROM schedules WHERE account = ? AND week = ?',
+                                     (account, week)).fetchone()
+        return row[0] if row is not None else None
+
+    def is_schedule_changed(self, account, week, text) -> bool:
+        with self._lock:
+            row = self._conn.execute('SELECT content_hash FROM schedules WHERE account = ? AND week = ?',
+                                     (account, week)).fetchone()
+        return row is None or row[0] != self._get_text_hash(text)
+
+    def set_schedule(self, account, week, text):
+        """Record schedule sent to subscribers"""
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO schedules VALUES (?, ?, ?, ?, ?)',
+                               (account, week, self._get_text_hash(text), text, time.time()))
+            self._conn.commit()
+
+    def prune(self, account, listed_ids):
+        """Remove messages of account older than retention (and their deliveries) and old schedules
+
+            Messages still listed in Librus (listed_ids) are kept, otherwise they would be taken as new ones.
+        """
+        since = time.time() - self._retention
+        listed_ids = set(listed_ids)
+        with self._lock:
+            old = [(account, r[0]) for r in self._conn.execute(
+                'SELECT message_id FROM messages WHERE account = ? AND seen_at < ?', (account, since)
+            ) if r[0] not in listed_ids]
+            self._conn.executemany('DELETE FROM deliveries WHERE account = ? AND message_id = ?', old)
+            self._conn.executemany('DELETE FROM messages WHERE account = ? AND message_id = ?', old)
+            schedules = self._conn.execute('DELETE FROM schedules WHERE account = ? AND sent_at < ?', (account, since))
+            self._conn.commit()
+        if old or schedules.rowcount:
+            logging.info(f'LibrusIndex - removed {len(old)} old messages and {schedules.rowcount} old schedules '
+                         f'of {account}')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _get_content_hash(self, message):
+        return self._get_text_hash('\0'.join((message['sender'], message['topic'], message['body'])))
+
+    def _get_text_hash(self, text):
+        return hashlib.sha256(text.encode('utf8')).hexdigest()
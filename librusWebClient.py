@@ -0,0 +1,229 @@
+import logging
+
+import common
+import config
+
+import re
+import requests
+import urllib.parse
+
+from html.parser import HTMLParser
+
+
+class _Element:
+    """Minimal HTML element - enough to find tags by attributes and read text like browser does"""
+    __slots__ = ('tag', 'attrs', 'children', 'parent')
+
+    def __init__(self, tag, attrs, parent):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []
+        self.parent = parent
+
+    def iter(self):
+        """Yield this element and all descendant elements in document order"""
+        stack = [self]
+        while stack:
+            e = stack.pop()
+            yield e
+            stack.extend(reversed([c for c in e.children if isinstance(c, _Element)]))
+
+    def get_classes(self):
+        return (self.attrs.get('class') or '').split()
+
+    def get_text(self):
+        """Return text with whitespaces collapsed, <br> and block elements as new lines"""
+        parts = []
+        self._collect_text(parts)
+        lines = ''.join(parts).split('\n')
+        text = '\n'.join(' '.join(line.split()) for line in lines).strip()
+        # Nested blocks give many new lines - keep at most one empty line, like browser
+        return re.sub(r'\n{3,}', '\n\n', text)
+
+    def _collect_text(self, parts):
+        for c in self.children:
+            if isinstance(c, str):
+                parts.append(c.replace('\n', ' '))
+            elif c.tag == 'br':
+                parts.append('\n')
+            elif c.tag not in _HTMLTreeBuilder.skipped_tags:
+                block = c.tag in _HTMLTreeBuilder.block_tags
+                if block:
+                    parts.append('\n')
+                c._collect_text(parts)
+                if block:
+                    parts.append('\n')
+
+
+class _HTMLTreeBuilder(HTMLParser):
+    """Build _Element tree from (possibly not well-formed) HTML"""
+    void_tags = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source',
+                           'track', 'wbr'))
+    block_tags = frozenset(('div', 'p', 'tr', 'table', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'))
+    skipped_tags = frozenset(('script', 'style', 'head'))
+
+    def __init__(self):
+        super().__init__()
+        self.root = _Element('document', {}, None)
+        self._current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        e = _Element(tag, dict(attrs), self._current)
+        self._current.children.append(e)
+        if tag not in self.void_tags:
+            self._current = e
+
+    def handle_startendtag(self, tag, attrs):
+        self._current.children.append(_Element(tag, dict(attrs), self._current))
+
+    def handle_endtag(self, tag):
+        # Close up to matching open tag; stray end tags are ignored
+        e = self._current
+        while e is not None and e.tag != tag:
+            e = e.parent
+        if e is not None and e.parent is not None:
+            self._current = e.parent
+
+    def handle_data(self, data):
+        self._current.children.append(data)
+
+
+def _parse_html(html):
+    builder = _HTMLTreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+def _is_logged(root):
+    return any(e.attrs.get('id') == LibrusWebClient.logged_user_id for e in root.iter())
+
+
+def get_message_id(url):
+    """Return id of message - path of its url, the same for absolute and relative link"""
+    return urllib.parse.urlsplit(url).path
+
+
+def parse_message_list(html):
+    """Return messages from messages list page as dicts with url (link as in page) and unread flag
+
+        Unread message has bold cells. Sender and topic link to the same message - it is returned once.
+        Empty list still has one row (with 'no messages' text) - page without any list row has unknown layout.
+        Raise RuntimeError if page is not for logged user or its layout is unknown.
+    """
+    root = _parse_html(html)
+    if not _is_logged(root):
+        raise RuntimeError('LibrusWebClient - You are not logged. Cannot fetch messages')
+    messages = {}
+    rows = 0
+    for tr in root.iter():
+        if tr.tag != 'tr' or not any(c.startswith('line') for c in tr.get_classes()):
+            continue
+        rows += 1
+        for td in tr.children:
+            if not isinstance(td, _Element) or td.tag != 'td':
+                continue
+            unread = 'bold' in (td.attrs.get('style') or '').replace(' ', '')
+            for a in td.iter():
+                href = a.attrs.get('href') if a.tag == 'a' else None
+                if href and LibrusWebClient.message_link_part in href:
+                    messages[href] = messages.get(href, False) or unread
+    if rows == 0:
+        raise RuntimeError('LibrusWebClient - Cannot find messages list in page. Page layout changed?')
+    return [{'url': url, 'unread': unread} for url, unread in messages.items()]
+
+
+def parse_message_page(html):
+    """Return dict with sender, topic and body of message page
+
+        Sender and topic are values next to their labels in message header table, body is message container.
+        Raise RuntimeError if page is not for logged user or it is not message page.
+    """
+    root = _parse_html(html)
+    if not _is_logged(root):
+        raise RuntimeError('LibrusWebClient - You are not logged. Cannot read message body')
+
+    message = {}
+    for tr in root.iter():
+        if tr.tag != 'tr':
+            continue
+        cells = [c for c in tr.children if isinstance(c, _Element) and c.tag in ('td', 'th')]
+        if len(cells) >= 2:
+            label = cells[0].get_text().rstrip(':').strip()
+            field = LibrusWebClient.message_header_labels.get(label)
+            if field is not None and field not in message:
+                message[field] = cells[1].get_text()
+    for div in root.iter():
+        if div.tag == 'div' and LibrusWebClient.message_body_class in div.get_classes():
+            message['body'] = div.get_text()
+            break
+
+    missing = [f for f in ('sender', 'topic', 'body') if f not in message]
+    if missing:
+        raise RuntimeError(f'LibrusWebClient - Cannot find {", ".join(missing)} in message page')
+    return {'sender': message['sender'], 'topic': message['topic'], 'body': message['body']}
+
+
+class LibrusWebClient:
+    """Read Librus Synergia messages with plain HTTP requests using cookies of logged browser session
+
+        Browser is needed only to log in. Pages are parsed by parse_message_list and parse_message_page
+        (pure functions - can be checked against saved pages).
+    """
+    logged_user_id = 'user-section'
+    message_header_labels = {'Nadawca': 'sender', 'Temat': 'topic'}
+    message_body_class = 'container-message-content'
+    message_link_part = '/wiadomosci/'
+
+    _pool_size = 4
+    _timeout = (5, 30)
+
+    def __init__(self, cookies, user_agent=None):
+        """cookies - list of dicts with name, value, domain and path (as returned by Network.getAllCookies)"""
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self._pool_size, pool_maxsize=self._pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        if user_agent is not None:
+            self._session.headers['User-Agent'] = user_agent
+        for c in cookies:
+            self._session.cookies.set(c['name'], c['value'], domain=c.get('domain', ''), path=c.get('path', '/'))
+
+    @classmethod
+    def from_driver(cls, driver):
+        """Create client with session (cookies and user agent) of logged webdriver"""
+        cookies = driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']
+        return cls(cookies, driver.execute_script('return navigator.userAgent'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._session.close()
+
+    def get_message_list(self):
+        """Return messages from first page of messages list as dicts with id, url and unread flag"""
+        logging.info('LibrusWebClient - Get messages list from librusSynergia.')
+        messages = parse_message_list(self._get(config.LIBRUS_MESSAGES_PAGE))
+        for m in messages:
+            m['url'] = urllib.parse.urljoin(config.LIBRUS_MESSAGES_PAGE, m['url'])
+            m['id'] = get_message_id(m['url'])
+        return messages
+
+    def get_message(self, url):
+        """Return message as dict with sender, topic and body (opening message marks it as read)"""
+        common.simulate_human_delay()
+        logging.info(f'LibrusWebClient - read message {url}')
+        return parse_message_page(self._get(url))
+
+    def _get(self, url):
+        try:
+            r = self._session.get(url, timeout=self._timeout)
+            r.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.error(f'LibrusWebClient - Cannot get {url}')
+            raise RuntimeError(e)
+        return r.text
@@ -0,0 +1,105 @@
+import logging
+
+import collections
+import json
+import sqlite3
+import threading
+import time
+
+
+class ProcessedMessageStore:
+    """Remember which messages (source + timestamp) were processed already, also across restarts
+
+        Keys are written to SQLite file and kept in memory (ordered by processing time) for O(1) lookups.
+        Only the newest max_entries keys not older than retention_days are kept - older ones are removed
+        from memory and file, so the store does not grow without limit.
+        Message is pending (with its content) until it is marked done. Pending messages (bot crashed or
+        handler failed) are returned by get_pending to be processed again, up to max_attempts times.
+    """
+    STATE_PENDING = 'pending'
+    STATE_DONE = 'done'
+
+    def __init__(self, path, max_entries=10000, retention_days=7, max_attempts=3):
+        self._max_entries = max_entries
+        self._max_attempts = max_attempts
+        self._retention = retention_days * 24 * 60 * 60
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS processed ('
+                           'source TEXT NOT NULL, timestamp TEXT NOT NULL, processed_at REAL NOT NULL, '
+                           "state TEXT NOT NULL DEFAULT 'done', message TEXT, attempts INTEGER NOT NULL DEFAULT 1, "
+                           'PRIMARY KEY (source, timestamp))')
+        self._keys = collections.OrderedDict(
+            ((source, timestamp), processed_at) for source, timestamp, processed_at in
+            self._conn.execute('SELECT source, timestamp, processed_at FROM processed ORDER BY processed_at')
+        )
+        with self._lock:
+            self._prune(time.time())
+        logging.info(f'ProcessedMessageStore - loaded {len(self._keys)} processed messages from {path}')
+
+    def mark_pending_if_new(self, message) -> bool:
+        """Record message as being processed. Return False if it was processed (or is pending) already"""
+        key = self._get_key(message)
+        now = time.time()
+        content = json.dumps({'source': message.get_source_account(), 'timestamp': message.get_timestamp(),
+                              'body': message.get_message_body(), 'reaction': message.get_reaction()})
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys[key] = now
+            self._conn.execute('INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, 1)',
+                               (*key, now, self.STATE_PENDING, content))
+            self._prune(now)
+            self._conn.commit()
+        return True
+
+    def mark_done(self, message):
+        """Record that message was processed successfully. Its content is not needed anymore"""
+        with self._lock:
+            self._conn.execute('UPDATE processed SET state = ?, message = NULL WHERE source = ? AND timestamp = ?',
+                               (self.STATE_DONE, *self._get_key(message)))
+            self._conn.commit()
+
+    def get_pending(self):
+        """Return content (dict with source, timestamp, body, reaction) of messages to be processed again
+
+            Each call counts an attempt. Messages that failed max_attempts times are marked done (given up).
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT source, timestamp, message, attempts FROM processed WHERE state = ? '
+                                      'ORDER BY processed_at', (self.STATE_PENDING,)).fetchall()
+            pending = []
+            for source, timestamp, content, attempts in rows:
+                if attempts >= self._max_attempts or content is None:
+                    logging.warning(f'ProcessedMessageStore - giving up message {timestamp} from {source} '
+                                    f'after {attempts} attempts')
+                    self._conn.execute('UPDATE processed SET state = ?, message = NULL '
+                                       'WHERE source = ? AND timestamp = ?', (self.STATE_DONE, source, timestamp))
+                else:
+                    self._conn.execute('UPDATE processed SET attempts = attempts + 1 '
+                                       'WHERE source = ? AND timestamp = ?', (source, timestamp))
+                    pending.append(json.loads(content))
+            self._conn.commit()
+        return pending
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _get_key(self, message):
+        return message.get_source_account(), str(message.get_timestamp())
+
+    def _prune(self, now):
+        """Remove oldest keys above limit or retention. Must be called with self._lock held"""
+        removed = []
+        while self._keys:
+            key, processed_at = next(iter(self._keys.items()))
+            if len(self._keys) <= self._max_entries and now - processed_at <= self._retention:
+                break
+            self._keys.popitem(last=False)
+            removed.append(key)
+        if removed:
+            self._conn.executemany('DELETE FROM processed WHERE source = ? AND timestamp = ?', removed)
+            self._conn.commit()
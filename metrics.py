@@ -0,0 +1,214 @@
+import logging
+
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MetricsRegistry:
+    """Counters, histograms and gauges of this process, rendered in Prometheus text format
+
+        Metrics are identified by name and labels (keyword arguments). Gauges are functions called when
+        metrics are rendered (e.g. queue depth). Events remember when they happened last time and are shown
+        as seconds since then.
+    """
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, prefix='signalbot_'):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._events = {}
+        self._health_checks = {}
+
+    def inc(self, name, value=1, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            histogram = self._histograms.setdefault(name, {})
+            data = histogram.get(key)
+            if data is None:
+                # counts per bucket, sum, count
+                data = histogram[key] = [[0] * len(self.default_buckets), 0.0, 0]
+            for i, bound in enumerate(self.default_buckets):
+                if seconds <= bound:
+                    data[0][i] += 1
+            data[1] += seconds
+            data[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe duration of with block (also when it raised)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def set_gauge(self, name, function, **labels):
+        """Register function returning current value of gauge"""
+        with self._lock:
+            self._gauges.setdefault(name, {})[self._get_key(labels)] = function
+
+    def mark_event(self, name):
+        with self._lock:
+            self._events[name] = time.time()
+
+    def add_health_check(self, name, is_healthy, details=None):
+        """Register functions checked by /health: is_healthy() -> bool, details() -> JSON serializable"""
+        with self._lock:
+            self._health_checks[name] = (is_healthy, details)
+
+    def get_health(self):
+        """Return (healthy, dict with result of each check)"""
+        with self._lock:
+            checks = list(self._health_checks.items())
+        healthy = True
+        results = {}
+        for name, (is_healthy, details) in checks:
+            try:
+                ok = bool(is_healthy())
+                results[name] = {'healthy': ok, 'details': details() if details is not None else None}
+            except Exception as e:
+                ok = False
+                results[name] = {'healthy': False, 'details': repr(e)}
+            healthy = healthy and ok
+        return healthy, results
+
+    def render(self) -> str:
+        """Return all metrics in Prometheus text exposition format"""
+        with self._lock:
+            counters = {n: dict(v) for n, v in self._counters.items()}
+            histograms = {n: {k: (list(d[0]), d[1], d[2]) for k, d in v.items()} for n, v in self._histograms.items()}
+            gauges = {n: dict(v) for n, v in self._gauges.items()}
+            events = dict(self._events)
+
+        lines = []
+        for name, values in sorted(counters.items()):
+            name = self._prefix + name + '_total'
+            lines.append(f'# TYPE {name} counter')
+            lines += [f'{name}{self._format_labels(k)} {v}' for k, v in sorted(values.items())]
+        for name, values in sorted(histograms.items()):
+            name = self._prefix + name
+            lines.append(f'# TYPE {name} histogram')
+            for key, (buckets, total, count) in sorted(values.items()):
+                for bound, bucket in zip(self.default_buckets, buckets):
+                    lines.append(f'{name}_bucket{self._format_labels(key + (("le", str(bound)),))} {bucket}')
+                lines.append(f'{name}_bucket{self._format_labels(key + (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{self._format_labels(key)} {total}')
+                lines.append(f'{name}_count{self._format_labels(key)} {count}')
+        for name, values in sorted(gauges.items()):
+            name = self._prefix + name
+            lines.append(f'# TYPE {name} gauge')
+            for key, function in sorted(values.items()):
+                try:
+                    lines.append(f'{name}{self._format_labels(key)} {function()}')
+                except Exception:
+                    logging.warning(f'Metrics - cannot get gauge {name}', exc_info=True)
+        if events:
+            name = self._prefix + 'seconds_since_last_event'
+            lines.append(f'# TYPE {name} gauge')
+            now = time.time()
+            for event, happened in sorted(events.items()):
+                lines.append(f'{name}{self._format_labels((("event", event),))} {now - happened:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def _get_key(self, labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _format_labels(self, key):
+        if not key:
+            return ''
+        escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in key)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + '}'
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serve /metrics (Prometheus text) and /health (JSON, 503 if any check failed)"""
+    registry = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send(200, 'text/plain; version=0.0.4; charset=utf-8', self.registry.render())
+        elif self.path == '/health':
+            healthy, checks = self.registry.get_health()
+            self._send(200 if healthy else 503, 'application/json',
+                       json.dumps({'healthy': healthy, 'checks': checks}))
+        else:
+            self._send(404, 'text/plain', 'Not found\n')
+
+    def log_message(self, format, *args):
+        logging.debug(f'Metrics - {self.address_string()} {format % args}')
+
+    def _send(self, code, content_type, body):
+        body = body.encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Heartbeat:
+    """Health check of loop that should make progress regularly (receive loop, job loop)
+
+        Loop calls beat() on every iteration. It is unhealthy when it did not beat for max_age seconds
+        (loop is stuck or dead) or did not start yet.
+    """
+
+    def __init__(self, max_age):
+        self._max_age = max_age
+        self._last_beat = None
+        self._beats = 0
+
+    def beat(self):
+        self._last_beat = time.monotonic()
+        self._beats += 1
+
+    def get_age(self):
+        """Return seconds since last beat or None if there was none"""
+        last_beat = self._last_beat
+        return time.monotonic() - last_beat if last_beat is not None else None
+
+    def is_healthy(self) -> bool:
+        age = self.get_age()
+        return age is not None and age <= self._max_age
+
+    def get_health(self) -> dict:
+        return {'seconds_since_beat': self.get_age(), 'max_age': self._max_age, 'beats': self._beats}
+
+
+registry = MetricsRegistry()
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+set_gauge = registry.set_gauge
+mark_event = registry.mark_event
+add_health_check = registry.add_health_check
+
+
+def add_heartbeat_check(name, max_age):
+    """Register Heartbeat health check and return it - call its beat() in every loop iteration"""
+    heartbeat = Heartbeat(max_age)
+    add_health_check(name, heartbeat.is_healthy, heartbeat.get_health)
+    return heartbeat
+
+
+def start_server(port, host='127.0.0.1'):
+    """Serve metrics of this process in background thread. Only localhost by default"""
+    handler = type('MetricsRequestHandler', (_MetricsRequestHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f'Metrics - serving http://{host}:{port}/metrics and /health')
+    return server
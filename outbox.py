@@ -0,0 +1,240 @@
+import logging
+
+import config
+
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from signalHandler import SignalTransientError
+
+
+class TokenBucket:
+    """Allow rate operations per second on average with bursts up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def wait_time(self, now) -> float:
+        """Return seconds until one token is available (0 - available now)"""
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def take(self, now):
+        self._refill(now)
+        self._tokens -= 1
+
+    def is_full(self, now) -> bool:
+        self._refill(now)
+        return self._tokens >= self._capacity
+
+    def _refill(self, now):
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class OutboxItem:
+    """Message waiting in Outbox"""
+
+    def __init__(self, recipient, message_body, quote_timestamp, attachments):
+        self.recipient = recipient
+        self.message_body = message_body
+        self.quote_timestamp = quote_timestamp
+        self.attachments = attachments
+        self.attempts = 0
+        self.next_try = 0
+        self.in_flight = False
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None) -> bool:
+        """Wait until message is delivered or dropped. Return True if it was delivered"""
+        return self._done.wait(timeout) and self.error is None
+
+    def can_merge(self, message_body, max_length) -> bool:
+        """Can be merged with another text if it is plain text that was not tried to be sent yet"""
+        return (not self.in_flight and self.attempts == 0 and not self.attachments and self.quote_timestamp is None
+                and len(self.message_body) + len(message_body) + 2 <= max_length)
+
+    def finish(self, error=None):
+        self.error = error
+        # Attachments are Outbox's own copies (see Outbox._copy_attachments) - not needed anymore
+        for a in self.attachments:
+            shutil.rmtree(os.path.dirname(a), ignore_errors=True)
+        self._done.set()
+
+
+class Outbox:
+    """Queue of outgoing messages sent in background within rate limits
+
+        Limits are token buckets per recipient and global. Messages to one recipient are sent in order.
+        Failed sends are retried with exponential backoff if the error is transient (SignalTransientError).
+        When queue backs up, plain texts waiting for the same recipient are merged into one message.
+        Messages ready at the same time are sent in one batch request if handler supports it.
+        Attachments are copied when message is queued (and removed when it is done), so caller can write
+        the same file again (e.g. next screenshot) before queued message is sent.
+    """
+    _attachments_dirname = '.outbox'
+    _merge_separator = '\n\n'
+    _global_rate = getattr(config, 'OUTBOX_GLOBAL_RATE', 2)
+    _global_burst = getattr(config, 'OUTBOX_GLOBAL_BURST', 10)
+    _recipient_rate = getattr(config, 'OUTBOX_RECIPIENT_RATE', 0.5)
+    _recipient_burst = getattr(config, 'OUTBOX_RECIPIENT_BURST', 3)
+    _max_retries = getattr(config, 'OUTBOX_MAX_RETRIES', 5)
+    _retry_delay = getattr(config, 'OUTBOX_RETRY_DELAY', 2)
+    _max_merged_length = getattr(config, 'OUTBOX_MAX_MERGED_LENGTH', 2000)
+    _max_batch = 20
+
+    def __init__(self, handler):
+        self._sh = handler
+        self._global_bucket = TokenBucket(self._global_rate, self._global_burst)
+        self._recipient_buckets = {}
+        self._cond = threading.Condition()
+        self._pending = []
+        self._worker = None
+
+    def send_message(self, recipient, message_body, quote_timestamp=None, attachments=[]) -> OutboxItem:
+        """Queue message. Return OutboxItem that can be waited for"""
+        attachments = self._copy_attachments(attachments)
+        with self._cond:
+            if not attachments and quote_timestamp is None:
+                # Only last waiting message of this recipient can be merged - keeps messages order
+                for item in reversed(self._pending):
+                    if item.recipient == recipient:
+                        if item.can_merge(message_body, self._max_merged_length):
+                            logging.info(f'Outbox - merge message to {recipient} with waiting one')
+                            item.message_body += self._merge_separator + message_body
+                            return item
+                        break
+            item = OutboxItem(recipient, message_body, quote_timestamp, attachments)
+            self._pending.append(item)
+            self._start_worker()
+            self._cond.notify_all()
+        return item
+
+    def send_messages(self, recipients, message_body, quote_timestamp=None, attachments=[]):
+        """Queue the same message for all given recipients. Return list of OutboxItem"""
+        return [self.send_message(r, message_body, quote_timestamp, attachments) for r in recipients]
+
+    def get_depth(self) -> int:
+        """Return number of messages waiting to be sent"""
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self, timeout=None) -> bool:
+        """Wait until all queued messages are delivered or dropped. Return False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def _copy_attachments(self, attachments):
+        """Return paths of attachments copies - each in own directory next to original, so file name is kept
+
+            Attachment that cannot be copied (e.g. it does not exist) is skipped - message is sent without it.
+        """
+        copies = []
+        for a in attachments:
+            directory = os.path.join(os.path.dirname(os.path.abspath(a)), self._attachments_dirname, uuid.uuid4().hex)
+            try:
+                os.makedirs(directory)
+                copies.append(shutil.copy(a, directory))
+            except OSError as e:
+                logging.error(f'Outbox - cannot queue attachment {a}. Sending without it: {e}')
+                shutil.rmtree(directory, ignore_errors=True)
+        return copies
+
+    def _start_worker(self):
+        """Start worker thread if not running. Must be called with self._cond held"""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._work, name='outbox', daemon=True)
+            self._worker.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    ready, wait = self._take_ready_items(time.monotonic())
+                    if ready:
+                        break
+                    self._cond.wait(wait)
+                for item in ready:
+                    item.in_flight = True
+                    item.attempts += 1
+
+            errors = self._deliver(ready)
+
+            with self._cond:
+                now = time.monotonic()
+                for item, error in zip(ready, errors):
+                    item.in_flight = False
+                    if error is None:
+                        self._pending.remove(item)
+                        item.finish()
+                    elif isinstance(error, SignalTransientError) and item.attempts <= self._max_retries:
+                        item.next_try = now + self._retry_delay * 2 ** (item.attempts - 1)
+                        logging.warning(f'Outbox - send to {item.recipient} failed ({error}). '
+                                        f'Retry in {item.next_try - now:.0f}s')
+                    else:
+                        logging.error(f'Outbox - send to {item.recipient} failed after {item.attempts} '
+                                      f'attempt(s). Dropping message: {error}')
+                        self._pending.remove(item)
+                        item.finish(error)
+                self._remove_idle_buckets(now)
+                self._cond.notify_all()
+
+    def _take_ready_items(self, now):
+        """Return items that can be sent now (tokens are taken) and seconds until next one can be sent"""
+        ready = []
+        wait = None
+        seen_recipients = set()
+        for item in self._pending:
+            if item.recipient in seen_recipients:
+                continue
+            seen_recipients.add(item.recipient)
+            if item.in_flight:
+                continue
+            bucket = self._get_recipient_bucket(item.recipient)
+            delay = max(item.next_try - now, bucket.wait_time(now), self._global_bucket.wait_time(now))
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            bucket.take(now)
+            self._global_bucket.take(now)
+            ready.append(item)
+            if len(ready) >= self._max_batch:
+                break
+        return ready, wait
+
+    def _deliver(self, items):
+        """Send items. Return list of errors (None for delivered)"""
+        if len(items) > 1 and hasattr(self._sh, 'batch'):
+            with self._sh.batch() as b:
+                calls = [b.send_message(i.recipient, i.message_body, i.quote_timestamp, i.attachments) for i in items]
+            return [c.error for c in calls]
+
+        errors = []
+        for i in items:
+            try:
+                self._sh.send_message(i.recipient, i.message_body, i.quote_timestamp, i.attachments)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def _get_recipient_bucket(self, recipient):
+        bucket = self._recipient_buckets.get(recipient)
+        if bucket is None:
+            bucket = self._recipient_buckets[recipient] = TokenBucket(self._recipient_rate, self._recipient_burst)
+        return bucket
+
+    def _remove_idle_buckets(self, now):
+        """Full bucket is the same as new one - forget it, so buckets do not grow without limit"""
+        waiting = {i.recipient for i in self._pending}
+        for recipient in [r for r, b in self._recipient_buckets.items() if r not in waiting and b.is_full(now)]:
+            del self._recipient_buckets[recipient]
@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 
 import config
+import metrics
+import tracing
 
 import argparse
+import asyncio
+import collections
+import datetime
 import logging
-import os
 import re
-import requests
-import schedule
 import time
 import urllib
-import uuid
 
+from commandRouter import CommandRouter
+from jobQueue import JobQueue, JobQueueFullError
+from messageStore import ProcessedMessageStore
+from outbox import Outbox
 from pytube import YouTube
-from signalHandler import SignalHandler, SignalRPCHandler
+from signalHandler import SignalHandler, SignalRPCHandler, SignalStdioHandler, AsyncSignalRPCHandler, SignalMessage
+from sseParser import SSEParser
+from supervisor import Supervisor
+from ytCache import YouTubeCache
 
 
 class SignalBot:
@@ -26,21 +34,32 @@ class SignalBot:
     _emoji_unknown = '❓'
     _emoji_ok = '👍'
 
-    _pattern_help = r'(help)'
-    _help_message_body = '''This is help for signalBot
+    _help_message_header = '''This is help for signalBot
 
-Accepted messages command:
-"Help" - return this message
-"Ping" - will return "Pong" in response - you can verified this way if bot is online
-<youtube_url> - if you send url to youtube video bot will convert it to audio file and sent you back link to it
-
-Automated behaviors:
+Accepted messages command:'''
+    _help_message_footer = '''Automated behaviors:
 - check Librus unread messages and send an info about them to subscribers'''
 
-    _pattern_ping = r'(ping)'
     _pattern_yt = r'(https?://)?(www\.)?(m\.)?(youtube\.com|youtu\.be)/.*'
     _pytube_audio_tag = 140
     _pytube_file_extension = '.mp4'
+    _yt_download_workers = getattr(config, 'YT_DOWNLOAD_WORKERS', 2)
+    _yt_max_jobs = getattr(config, 'YT_MAX_JOBS', 10)
+    _yt_max_jobs_per_user = getattr(config, 'YT_MAX_JOBS_PER_USER', 3)
+    _yt_cache_max_size_mb = getattr(config, 'YT_CACHE_MAX_SIZE_MB', 2048)
+    _yt_cache_ttl_days = getattr(config, 'YT_CACHE_TTL_DAYS', 30)
+    _processed_messages_db = getattr(config, 'PROCESSED_MESSAGES_DB', 'processedMessages.sqlite')
+    _processed_messages_max = getattr(config, 'PROCESSED_MESSAGES_MAX', 10000)
+    _processed_messages_retention_days = getattr(config, 'PROCESSED_MESSAGES_RETENTION_DAYS', 7)
+    _receive_min_timeout = getattr(config, 'SIGNAL_RECEIVE_MIN_TIMEOUT', 30)
+    _receive_max_timeout = getattr(config, 'SIGNAL_RECEIVE_MAX_TIMEOUT', 120)
+    _receive_max_messages = getattr(config, 'SIGNAL_RECEIVE_MAX_MESSAGES', 1)
+    _receive_drain_timeout = getattr(config, 'SIGNAL_RECEIVE_DRAIN_TIMEOUT', 1)
+    _receive_drain_max_messages = getattr(config, 'SIGNAL_RECEIVE_DRAIN_MAX_MESSAGES', 50)
+    _metrics_port = getattr(config, 'METRICS_PORT', None)
+    _flush_timeout = getattr(config, 'OUTBOX_FLUSH_TIMEOUT', 600)
+    # /health reports receive loop as stalled when its iteration (receive and processing) takes longer
+    _health_loop_max_age = getattr(config, 'HEALTH_LOOP_MAX_AGE', 600)
 
     def __init__(self, filename=_log_filename, encoding=_log_default_encoding, level=_log_default_level):
         """Init logging, signal handler etc."""
@@ -50,17 +69,103 @@ Automated behaviors:
                             encoding=encoding,
                             level=level)
         self._sh = SignalHandler()
+        self._setup()
+
+    def _setup(self):
+        """Init parts shared by all bot versions"""
+        self._yt_jobs = JobQueue('yt', self._yt_download_workers, self._yt_max_jobs, self._yt_max_jobs_per_user)
+        self._yt_cache = YouTubeCache(config.HTTP_YT_LOCATION, self._yt_cache_max_size_mb, self._yt_cache_ttl_days)
+        self._router = CommandRouter()
+        self._register_commands()
+        self._outbox = Outbox(self._sh)
+        self._processed = ProcessedMessageStore(self._processed_messages_db, self._processed_messages_max,
+                                                self._processed_messages_retention_days)
+        metrics.set_gauge('queue_depth', self._outbox.get_depth, queue='outbox')
+        metrics.set_gauge('queue_depth', self._yt_jobs.get_waiting_count, queue='yt')
+        if self._metrics_port is not None:
+            metrics.start_server(self._metrics_port)
+
+    def _register_commands(self):
+        """Register all known message commands. Order here is the order in help message"""
+        self._router.register('help', self._process_help_message, keyword='help',
+                              help_text='return this message')
+        self._router.register('ping', self._process_ping_message, keyword='ping',
+                              help_text='will return "Pong" in response - you can verified this way if bot is online')
+        self._router.register('status', self._process_status_message, keyword='status',
+                              help_text='show your queued and running downloads')
+        self._router.register('yt', self._process_yt_message, pattern=self._pattern_yt, usage='<youtube_url>',
+                              help_text='if you send url to youtube video bot will convert it to audio file and '
+                                        'sent you back link to it\n'
+                                        '                (download runs in background, you can send more links '
+                                        'meanwhile)')
 
     def run(self):
         """Main loop of signalBot"""
+        self._process_pending_messages()
+        self._receive_and_process_messages()
+
+    def run_forever(self, until=None):
+        """Receive and process messages until given time of day (datetime.time) or forever (None)
+
+            Each signal-cli receive waits for messages and returns as soon as max messages came, so reply is sent
+            without delay. Messages usually come in bursts, so after that one receive with short drain timeout
+            takes the rest of the burst - one signal-cli start instead of one per message. When nothing comes,
+            timeout grows up to max timeout - less signal-cli starts when idle.
+            Receive locks account (other signal-cli commands wait for it), so max timeout should stay modest.
+        """
+        self._process_pending_messages()
+        timeout = self._receive_min_timeout
+        draining = False
+        heartbeat = metrics.add_heartbeat_check('receive_loop', self._health_loop_max_age)
+        logging.info('BOT - Start listen for new messages with signal-cli receive')
+        while until is None or datetime.datetime.now().time() < until:
+            heartbeat.beat()
+            started = time.monotonic()
+            if draining:
+                wait = self._receive_drain_timeout
+                received = self._receive_and_process_messages(wait, self._receive_drain_max_messages)
+            else:
+                wait = timeout
+                received = self._receive_and_process_messages(wait, self._receive_max_messages)
+            if received:
+                draining = True
+                timeout = self._receive_min_timeout
+            else:
+                if received is None:
+                    # Error - do not call signal-cli again at once
+                    time.sleep(max(0, wait - (time.monotonic() - started)))
+                if draining:
+                    draining = False
+                else:
+                    timeout = min(timeout * 2, self._receive_max_timeout)
+
+    def _receive_and_process_messages(self, timeout=None, max_messages=None):
+        """Receive and process new messages. Return number of them or None if receive failed
+
+            Messages are processed one by one - failure of one does not stop the others, as signal-cli
+            does not give them again.
+        """
         try:
-            for m in self._sh.receive_new_messages():
-                self._process_message(m)
+            messages = self._sh.receive_new_messages(timeout=timeout, max_messages=max_messages)
         except Exception:
             logging.error('SignalBot - unexpected error', exc_info=True)
             self._send_error_message('SignalBot - unexpected error')
+            return None
+        for m in messages:
+            try:
+                self._process_message(m)
+            except Exception:
+                logging.error(f'SignalBot - cannot process message {m.get_timestamp()}', exc_info=True)
+                self._send_error_message('SignalBot - unexpected error')
+        return len(messages)
+
+    def flush_messages(self):
+        """Wait until all queued messages (e.g. alerts for admins) are sent. Call it before exit"""
+        if not self._outbox.flush(self._flush_timeout):
+            logging.error(f'SignalBot - {self._outbox.get_depth()} messages not sent in {self._flush_timeout}s')
 
     def test(self, test_account):
+        # Directly, not via Outbox - command line run (--test) must see at once if sending works
         self._sh.send_message(test_account, 'Test message', attachments=['file.txt'])
 
     def welcome_message(self, new_account):
@@ -68,11 +173,55 @@ Automated behaviors:
         logging.info(f'BOT - Send welcome message to {new_account}\n\n'
                      'Ask administrator to add your number to trusted ones I will not be able to handle your messages\n'
                      'Send "Help" message to get list of available commands')
+        # Directly, not via Outbox - command line run (--welcome) must see at once if number is reachable
         self._sh.send_message(new_account, 'Hello! This is signalBot :)')
 
     def _process_message(self, message):
         """Check what type of command is in the message and respond to it"""
-        self._sh.send_receipt(message)
+        with tracing.activate(self._sh.start_message_trace(message)):
+            if not self._processed.mark_pending_if_new(message):
+                logging.info(f'BOT - message {message.get_timestamp()} was already processed. Skipping')
+                tracing.set_attribute('duplicate', True)
+                return
+            with metrics.timer('message_processing_seconds'):
+                self._process_new_message(message)
+            # Only now - if handler failed (or bot crashed) message is processed again after restart
+            self._processed.mark_done(message)
+
+    def _process_pending_messages(self):
+        """Process again messages which processing did not finish last time (bot crashed or handler failed)"""
+        messages = [SignalMessage(timestamp=data['timestamp'], source_account=data['source'],
+                                  message_body=data['body'], reaction=data['reaction'])
+                    for data in self._processed.get_pending()]
+        if messages:
+            self._send_receipts(messages)
+        for message in messages:
+            logging.info(f'BOT - processing not finished message {message.get_timestamp()} again')
+            try:
+                with metrics.timer('message_processing_seconds'):
+                    self._process_new_message(message)
+                self._processed.mark_done(message)
+            except Exception:
+                logging.error(f'SignalBot - cannot process message {message.get_timestamp()}', exc_info=True)
+
+    def _send_receipts(self, messages):
+        """Send receipts for many messages at once (one batch request with jsonRPC)
+
+            Messages with receipt sent are marked, so it is not sent again when they are processed.
+        """
+        try:
+            calls = self._sh.send_receipts(messages)
+        except RuntimeError:
+            logging.warning('SignalBot - cannot send receipts. They are sent one by one', exc_info=True)
+            return
+        for m, c in zip(messages, calls):
+            if not c.failed():
+                m.mark_as_readed()
+
+    def _process_new_message(self, message):
+        """Respond to message that was not processed before"""
+        if not message.get_sent_receipt():
+            self._sh.send_receipt(message)
 
         body = message.get_message_body()
         logging.info(f'BOT - trying to process message {message.get_timestamp()}')
@@ -84,47 +233,92 @@ Automated behaviors:
         else:
             logging.warning('BOT - Message type unknown')
             logging.debug(f'message_body: {message}')
+            metrics.inc('commands', command='unknown')
             self._sh.send_reaction(message, self._emoji_unknown)
 
     def _find_known_message_body_pattern(self, message):
-        """Use regexp to find known message instruction"""
-        body = message.get_message_body()
-
-        if re.fullmatch(self._pattern_help, body, re.IGNORECASE) is not None:
-            self._process_help_message(message)
-            return True
-        if re.fullmatch(self._pattern_ping, body, re.IGNORECASE) is not None:
-            self._process_ping_message(message)
-            return True
-        if re.search(self._pattern_yt, body) is not None:
-            self._process_yt_message(message)
-            return True
-        return False
+        """Find known message instruction and process it. Return False if message is unknown"""
+        return self._router.dispatch(message)
 
     def _process_help_message(self, message):
         """Return simple pong"""
         logging.info('BOT - Found HELP message. Responding with instructions')
-        self._sh.send_message(message.get_source_account(), self._help_message_body, message.get_timestamp())
+        help_message_body = f'{self._help_message_header}\n{self._router.get_help()}\n\n{self._help_message_footer}'
+        self._outbox.send_message(message.get_source_account(), help_message_body, message.get_timestamp())
 
     def _process_ping_message(self, message):
         """Return simple pong"""
         logging.info('BOT - Found PING message. Responding PONG')
-        self._sh.send_message(message.get_source_account(), 'pong', message.get_timestamp())
+        self._outbox.send_message(message.get_source_account(), 'pong', message.get_timestamp())
+
+    def _process_status_message(self, message):
+        """Return list of user's background jobs"""
+        logging.info('BOT - Found STATUS message. Responding with jobs list')
+        jobs = self._yt_jobs.get_jobs(message.get_source_account())
+        if jobs:
+            status = 'Your jobs:\n' + '\n'.join(str(j) for j in jobs)
+        else:
+            status = 'You have no jobs in queue'
+        status += f'\n\nAll jobs waiting in queue: {self._yt_jobs.get_waiting_count()}'
+        self._outbox.send_message(message.get_source_account(), status, message.get_timestamp())
 
     def _process_yt_message(self, message):
-        """Download given YouTube as mp3 or mp4"""
-        logging.info('BOT - Found YouTube message. Download file')
-        dirname = str(uuid.uuid4())
-        os_path = os.path.join(config.HTTP_YT_LOCATION, dirname)
-        os.mkdir(os_path)
-        yt = YouTube(message.get_message_body())
+        """Send link to given YouTube. If not downloaded yet queue download and send link when it is done"""
+        logging.info('BOT - Found YouTube message')
+        try:
+            cached = self._yt_cache.lookup(message.get_message_body(), self._pytube_audio_tag)
+        except RuntimeError as e:
+            logging.warning(f'BOT - {e}')
+            self._outbox.send_message(message.get_source_account(), 'Cannot find video in this link',
+                                      message.get_timestamp())
+            return
+        if cached is not None:
+            logging.info('BOT - File already downloaded. Sending link')
+            self._send_yt_link(message, *cached)
+            return
+
+        logging.info('BOT - Queue download')
+        waiting = self._yt_jobs.get_waiting_count()
+        try:
+            self._yt_jobs.submit(message.get_source_account(), f'YouTube {message.get_message_body()}',
+                                 self._download_yt, message)
+        except JobQueueFullError as e:
+            logging.warning(f'BOT - Cannot queue YouTube download: {e}')
+            self._outbox.send_message(message.get_source_account(), f'Cannot download: {e}', message.get_timestamp())
+        else:
+            self._outbox.send_message(message.get_source_account(),
+                                      f'Download queued ({waiting} jobs before yours). I will send you link when ready',
+                                      message.get_timestamp())
+
+    def _download_yt(self, message):
+        """Get given YouTube as mp4 audio (from cache or download it) and send link to it"""
+        try:
+            with tracing.span('yt_download'):
+                dirname, filename = self._yt_cache.get(message.get_message_body(), self._pytube_audio_tag,
+                                                       self._download_yt_stream)
+        except Exception:
+            logging.error('BOT - YouTube download failed', exc_info=True)
+            metrics.inc('yt_download_errors')
+            self._outbox.send_message(message.get_source_account(), 'Cannot download this video',
+                                      message.get_timestamp())
+            return
+        self._send_yt_link(message, dirname, filename)
+
+    def _download_yt_stream(self, url, itag, os_path):
+        """Download YouTube stream with given itag into os_path and return its filename"""
+        yt = YouTube(url)
         filename = yt.title[:48] + self._pytube_file_extension
         filename = re.sub(' ', '_', filename)
-        stream = yt.streams.get_by_itag(self._pytube_audio_tag)
-        final_file = stream.download(output_path=os_path, filename=filename)
+        stream = yt.streams.get_by_itag(itag)
+        with metrics.timer('yt_download_seconds'):
+            final_file = stream.download(output_path=os_path, filename=filename)
         logging.info(f'BOT - File downloaded as {final_file}')
+        return filename
+
+    def _send_yt_link(self, message, dirname, filename):
         parsed_filename = urllib.parse.quote_plus(filename)
-        self._sh.send_message(message.get_source_account(), f'{config.YT_SERVER_PREFIX}{dirname}/{parsed_filename}', message.get_timestamp())
+        self._outbox.send_message(message.get_source_account(), f'{config.YT_SERVER_PREFIX}{dirname}/{parsed_filename}',
+                                  message.get_timestamp())
 
     def _process_reaction(self, message):
         """Process reaction to previous messages"""
@@ -133,8 +327,7 @@ Automated behaviors:
 
     def _send_error_message(self, message_body, attachments=[]):
         """Send messages to admins about errors"""
-        for a in config.SIGNAL_ADMINS:
-            self._sh.send_message(a, message_body, attachments=attachments)
+        return self._outbox.send_messages(config.SIGNAL_ADMINS, message_body, attachments=attachments)
 
 
 class SignalRPCBot(SignalBot):
@@ -143,6 +336,11 @@ class SignalRPCBot(SignalBot):
     _log_filename = 'signalRPCBot.log'
     _log_default_level = logging.INFO
     _log_default_encoding = 'utf8'
+    _stream_reconnect_delay = 1
+    _supervisor_min_delay = getattr(config, 'SUPERVISOR_MIN_DELAY', 1)
+    _supervisor_max_delay = getattr(config, 'SUPERVISOR_MAX_DELAY', 300)
+    _supervisor_alert_after = getattr(config, 'SUPERVISOR_ALERT_AFTER', 5)
+    _supervisor_healthy_after = getattr(config, 'SUPERVISOR_HEALTHY_AFTER', 60)
 
     def __init__(self, filename=_log_filename, encoding=_log_default_encoding, level=_log_default_level):
         """Init logging, signal handler etc."""
@@ -152,26 +350,189 @@ class SignalRPCBot(SignalBot):
                             encoding=encoding,
                             level=level)
         self._sh = SignalRPCHandler()
+        self._setup()
+
+    def _setup(self):
+        """Init parts shared by all bot versions"""
+        super()._setup()
+        self._supervisor = Supervisor('SignalBot', self._send_error_message, self._supervisor_min_delay,
+                                      self._supervisor_max_delay, self._supervisor_alert_after,
+                                      self._supervisor_healthy_after)
+        metrics.add_health_check('message_stream', self._supervisor.is_healthy, self._supervisor.get_health)
+
+    def run(self):
+        """Main loop of signalBot. Message stream is opened again (with backoff) whenever it breaks"""
+        self._process_pending_messages()
+        logging.info(f'BOT - Start listen for new messages at {config.SIGNALRPC_MESSAGE_STREAM_ENDPOINT}')
+        parser = SSEParser()
+        self._supervisor.run(lambda: self._consume_message_stream(parser),
+                             clean_exit_delay=lambda: self._get_reconnect_delay(parser))
+
+    def _consume_message_stream(self, parser):
+        """Process messages from stream until server closes it"""
+        for data in self._sh.iter_message_stream(parser):
+            self._supervisor.report_progress()
+            logging.debug(f'BOT - Received new message: {data}')
+            for m in self._sh.parse_message(data):
+                try:
+                    self._process_message(m)
+                except Exception:
+                    logging.error('SignalBot - unexpected error', exc_info=True)
+                    self._send_error_message('SignalBot - unexpected error')
+
+    def _get_reconnect_delay(self, parser):
+        """Return seconds to wait before reconnect. Server can set it with retry field (in ms)"""
+        if parser.retry is not None:
+            return parser.retry / 1000
+        return self._stream_reconnect_delay
+
+
+class AsyncSignalRPCBot(SignalRPCBot):
+    """SignalRPCBot that reads message stream with asyncio and processes messages concurrently
+
+        Messages from the same sender are processed one by one in order they came. Messages from
+        different senders are processed at the same time (up to _max_concurrent_messages), so one slow
+        command does not block replies for others. Command handlers are sync and run in worker threads.
+    """
+    _log_filename = 'signalAsyncRPCBot.log'
+    _log_default_level = logging.INFO
+    _log_default_encoding = 'utf8'
+    _max_concurrent_messages = getattr(config, 'BOT_MAX_CONCURRENT_MESSAGES', 4)
+
+    def __init__(self, filename=_log_filename, encoding=_log_default_encoding, level=_log_default_level):
+        """Init logging, signal handler etc."""
+        logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                            datefmt='%Y-%m-%d %H:%M:%S',
+                            filename=filename,
+                            encoding=encoding,
+                            level=level)
+        self._sh = AsyncSignalRPCHandler()
+        self._setup()
+        self._semaphore = None
+        self._sender_queues = {}
+        self._tasks = set()
+        metrics.set_gauge('queue_depth', lambda: sum(len(q) for q in list(self._sender_queues.values())),
+                          queue='messages')
 
     def run(self):
         """Main loop of signalBot"""
+        self._process_pending_messages()
+        asyncio.run(self._run_async())
+
+    async def _run_async(self):
+        """Read message stream and dispatch every message as separate task"""
+        self._semaphore = asyncio.Semaphore(self._max_concurrent_messages)
+        await self._sh.open()
         try:
             logging.info(f'BOT - Start listen for new messages at {config.SIGNALRPC_MESSAGE_STREAM_ENDPOINT}')
-            r = requests.get(config.SIGNALRPC_MESSAGE_STREAM_ENDPOINT, stream=True)
-
-            for line in r.iter_lines():
-                # filter out keep-alive new lines
-                if line:
-                    decoded_line = line.decode('utf-8')
-                    if decoded_line[:5] == 'data:':
-                        logging.debug(f'BOT - Received new message: {decoded_line[5:]}')
-                        for m in self._sh.parse_message(decoded_line[5:]):
-                            self._process_message(m)
+            parser = SSEParser()
+            await self._supervisor.run_async(lambda: self._consume_message_stream_async(parser),
+                                             clean_exit_delay=lambda: self._get_reconnect_delay(parser))
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            await asyncio.to_thread(self.flush_messages)
+            await self._sh.aclose()
+
+    async def _consume_message_stream_async(self, parser):
+        """Dispatch messages from stream until server closes it"""
+        async for data in self._sh.iter_message_stream(parser):
+            self._supervisor.report_progress()
+            logging.debug(f'BOT - Received new message: {data}')
+            for m in self._sh.parse_message(data):
+                self._dispatch_message(m)
+
+    def _dispatch_message(self, message):
+        """Add message to its sender queue. Start queue processing if not running"""
+        sender = message.get_source_account()
+        q = self._sender_queues.get(sender)
+        if q is None:
+            q = self._sender_queues[sender] = collections.deque()
+            task = asyncio.create_task(self._process_sender_queue(sender, q))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        q.append(message)
+
+    async def _process_sender_queue(self, sender, q):
+        """Process all messages of one sender in order"""
+        while q:
+            m = q.popleft()
+            async with self._semaphore:
+                try:
+                    await self._process_message_async(m)
+                except Exception:
+                    logging.error(f'SignalBot - cannot process message {m.get_timestamp()}', exc_info=True)
+                    await asyncio.to_thread(self._send_error_message, 'SignalBot - unexpected error')
+        del self._sender_queues[sender]
+
+    async def _process_message_async(self, message):
+        """Check what type of command is in the message and respond to it"""
+        with tracing.activate(self._sh.start_message_trace(message)):
+            if not self._processed.mark_pending_if_new(message):
+                logging.info(f'BOT - message {message.get_timestamp()} was already processed. Skipping')
+                tracing.set_attribute('duplicate', True)
+                return
+            with metrics.timer('message_processing_seconds'):
+                await self._process_new_message_async(message)
+            self._processed.mark_done(message)
+
+    async def _process_new_message_async(self, message):
+        """Respond to message that was not processed before"""
+        await self._sh.send_receipt_async(message)
+
+        body = message.get_message_body()
+        logging.info(f'BOT - trying to process message {message.get_timestamp()}')
+        if body is None:
+            logging.info('BOT - No body message. Looking for other message types')
+            logging.warning('Not implemented yet!')
+        elif await asyncio.to_thread(self._find_known_message_body_pattern, message):
+            await self._sh.send_reaction_async(message, self._emoji_ok)
+        else:
+            logging.warning('BOT - Message type unknown')
+            logging.debug(f'message_body: {message}')
+            metrics.inc('commands', command='unknown')
+            await self._sh.send_reaction_async(message, self._emoji_unknown)
+
+
+class SignalStdioBot(SignalBot):
+    """Perform signalBot actions via one long-lived signal-cli jsonRpc process (no HTTP daemon needed)"""
+    _log_filename = 'signalStdioBot.log'
+    _log_default_level = logging.INFO
+    _log_default_encoding = 'utf8'
+    _receive_timeout = 60
+
+    def __init__(self, filename=_log_filename, encoding=_log_default_encoding, level=_log_default_level):
+        """Init logging, signal handler etc."""
+        logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                            datefmt='%Y-%m-%d %H:%M:%S',
+                            filename=filename,
+                            encoding=encoding,
+                            level=level)
+        self._sh = SignalStdioHandler()
+        self._setup()
+
+    def run(self):
+        """Main loop of signalBot"""
+        try:
+            self._process_pending_messages()
+            heartbeat = metrics.add_heartbeat_check('receive_loop', self._health_loop_max_age)
+            logging.info('BOT - Start listen for new messages from signal-cli jsonRpc process')
+            while True:
+                heartbeat.beat()
+                # Timeout lets handler restart signal-cli if it died in the meantime
+                for m in self._sh.receive_new_messages(timeout=self._receive_timeout):
+                    try:
+                        self._process_message(m)
+                    except Exception:
+                        logging.error('SignalBot - unexpected error', exc_info=True)
+                        self._send_error_message('SignalBot - unexpected error')
         except Exception:
             logging.error('SignalBot - unexpected error', exc_info=True)
             self._send_error_message('SignalBot - FATAL: unexpected error.')
-
-
+        finally:
+            # Outbox sends via signal-cli process - alerts must go out before it is stopped
+            self.flush_messages()
+            self._sh.close()
 
 
 def main():
@@ -185,10 +546,16 @@ This BOT has two options:
 signalBOT (default) - call each command by create subprocess of signal-cli tool. This is easier to
                       to handle but is slow
 signalRPCBOT (use --rpc option to set) - uses HTTP jsonRPC endpoint to call signal-cli. Needs the
-                                         endpoint creation before you run the script in other thread.'''
+                                         endpoint creation before you run the script in other thread.
+signalStdioBOT (use --stdio option to set) - starts one signal-cli jsonRpc process and talks to it via
+                                             stdin/stdout. Fast like signalRPCBOT without separate daemon.'''
     parser = argparse.ArgumentParser(description=desc, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('--rpc', action='store_true',
                         help='If set the signalRPCBOT version will be used (instead of signalBOT)')
+    parser.add_argument('--async', action='store_true', dest='use_async',
+                        help='Use with --rpc. Process messages from different users concurrently (asyncio)')
+    parser.add_argument('--stdio', action='store_true',
+                        help='If set the signalStdioBOT version will be used (instead of signalBOT)')
     parser.add_argument('--welcome', metavar=('PHONE_NUMBER'),
                         help='Send welcome message to given PHONE_NUMBER')
     parser.add_argument('--test', metavar=('PHONE_NUMBER'),
@@ -196,11 +563,24 @@ signalRPCBOT (use --rpc option to set) - uses HTTP jsonRPC endpoint to call sign
 
     args = parser.parse_args()
     is_rpc = args.rpc
+    use_async = args.use_async
+    is_stdio = args.stdio
     welcome_new_phone = args.welcome
     test_message = args.test
 
     if is_rpc:
-        sb = SignalRPCBot(level=logging.DEBUG)
+        if use_async:
+            sb = AsyncSignalRPCBot(level=logging.DEBUG)
+        else:
+            sb = SignalRPCBot(level=logging.DEBUG)
+        if welcome_new_phone is not None:
+            sb.welcome_message(welcome_new_phone)
+        elif test_message is not None:
+            sb.test(test_message)
+        else:
+            sb.run()
+    elif is_stdio:
+        sb = SignalStdioBot(level=logging.DEBUG)
         if welcome_new_phone is not None:
             sb.welcome_message(welcome_new_phone)
         elif test_message is not None:
@@ -214,11 +594,8 @@ signalRPCBOT (use --rpc option to set) - uses HTTP jsonRPC endpoint to call sign
         elif test_message is not None:
             sb.test(test_message)
         else:
-            schedule.every(30).seconds.until('22:30').do(sb.run)
-
-            while True:
-                schedule.run_pending()
-                time.sleep(1)
+            sb.run_forever(until=datetime.time(22, 30))
+    sb.flush_messages()
 
 
 if __name__ == '__main__':
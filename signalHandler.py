@@ -2,14 +2,38 @@
 
 import common
 import config
+import metrics
+import tracing
 
+import asyncio
 import json
 import logging
+import queue
 import requests
 import subprocess
 import sys
+import threading
+import time
 
 from jsonrpcclient import request, parse, Ok
+from sseParser import SSEParser
+
+try:
+    # Needed only by AsyncSignalRPCHandler (signalBot.py --rpc --async)
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    # Optional faster json parser. It also accepts bytes, so lines do not need to be decoded first
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+class SignalTransientError(RuntimeError):
+    """Call failed for reason that may go away (network, server error, rate limit). Worth to retry later"""
 
 
 class SignalHandler:
@@ -18,6 +42,8 @@ class SignalHandler:
     _is_already_decoded = False
     _signal_cmd = [config.SIGNAL_CMD_PATH, '-o', 'json']
     _cmd_receive = 'receive'
+    _cmd_receive_param_timeout = '--timeout'
+    _cmd_receive_param_max_messages = '--max-messages'
     _cmd_send_receipt = 'sendReceipt'
     _cmd_send_receipt_param_timestamp = '-t'
     _cmd_send_receipt_param_type = '--type'
@@ -32,58 +58,101 @@ class SignalHandler:
     _cmd_send_message_param_attachment = '-a'
     _cmd_send_message_param_quote_timestamp = '--quote-timestamp'
     _cmd_send_message_param_quote_author = '--quote-author'
-
-    def receive_new_messages(self):
-        """Receive new messages from server"""
-        return self._parse_messages(self._call(self._cmd_receive))
+    # signal-cli exit codes: 3 - server or IO error, 5 - rate limit
+    _transient_return_codes = (3, 5)
+    _data_message_key = '"dataMessage"'
+    _data_message_key_bytes = b'"dataMessage"'
+    _allowed_end_users = frozenset(config.ALLOWED_END_USERS)
+    _metrics_transport = 'cli'
+
+    def receive_new_messages(self, timeout=None, max_messages=None):
+        """Receive new messages from server
+
+            timeout - seconds to wait for new messages (None - signal-cli default)
+            max_messages - return as soon as this number of messages was received
+        """
+        extra_args = []
+        if timeout is not None:
+            extra_args += [self._cmd_receive_param_timeout, timeout]
+        if max_messages is not None:
+            extra_args += [self._cmd_receive_param_max_messages, max_messages]
+        output_lines = self._call(self._cmd_receive, extra_args)
+        tracing.mark_received()
+        return self._parse_messages(output_lines)
 
     def send_receipts(self, messages, receipt_type=_cmd_send_receipt_default_type):
-        """Send receipt of given type for all given messages"""
-        responses = []
-        for m in messages:
-            responses.append(self.send_receipt(m, receipt_type))
-        return responses
+        """Send receipt of given type for all given messages. Return SignalRPCBatchCall (result or error) per message"""
+        return self._send_each(self._cmd_send_receipt,
+                               [lambda m=m: self.send_receipt(m, receipt_type) for m in messages])
 
     def send_receipt(self, message, receipt_type=_cmd_send_receipt_default_type):
         """Send receipt of given type for one message"""
         logging.debug(f'send_receipt.message: {message}')
-        ac = message.get_source_account()
-        ts = message.get_timestamp()
-        return self._parse_receipt_response(
-            self._call(self._cmd_send_receipt, [
-                ac, self._cmd_send_receipt_param_timestamp, ts, self._cmd_send_receipt_param_type, receipt_type
-            ])
-        )
+        with tracing.span('send_receipt', transport=self._metrics_transport):
+            return self._parse_receipt_response(self._call(*self._receipt_args(message, receipt_type)))
 
     def send_reactions(self, messages, emoji=_cmd_send_reaction_emoji_ok):
-        """Send reaction for all given messages"""
-        responses = []
-        for m in messages:
-            responses.append(self.send_reaction(m, emoji))
-        return responses
+        """Send reaction for all given messages. Return SignalRPCBatchCall (result or error) per message"""
+        return self._send_each(self._cmd_send_reaction, [lambda m=m: self.send_reaction(m, emoji) for m in messages])
 
     def send_reaction(self, message, emoji=_cmd_send_reaction_emoji_ok):
         """Send reaction for message"""
         logging.debug(f'send_reaction.message: {message}')
         logging.debug(f'send_reaction.emoji: {emoji}')
-        ac = message.get_source_account()
-        ts = message.get_timestamp()
-        return self._parse_receipt_response(
-            self._call(self._cmd_send_reaction, [
-                ac,
-                self._cmd_send_reaction_param_author,
-                ac,
-                self._cmd_send_reaction_param_timestamp,
-                ts,
-                self._cmd_send_reaction_param_emoji,
-                emoji
-            ])
-        )
+        with tracing.span('send_reaction', transport=self._metrics_transport):
+            return self._parse_receipt_response(self._call(*self._reaction_args(message, emoji)))
+
+    def send_messages(self, recipients, message_body, quote_timestamp=None, attachments=[]):
+        """Send the same message to all given recipients. Return SignalRPCBatchCall (result or error) per recipient"""
+        return self._send_each(self._cmd_send_message, [
+            lambda r=r: self.send_message(r, message_body, quote_timestamp, attachments) for r in recipients
+        ])
+
+    def _send_each(self, command, sends):
+        """Call sends one by one. Failure of one does not stop others - its error is kept in its call"""
+        calls = []
+        for send in sends:
+            c = SignalRPCBatchCall(command, None)
+            try:
+                c.set_result(send())
+            except RuntimeError as e:
+                c.set_error(e)
+            calls.append(c)
+        return calls
 
     def send_message(self, recipient, message_body, quote_timestamp=None, attachments=[]):
         """Send a message to another user"""
         logging.debug(f'send_message.recipient: {recipient}')
         logging.debug(f'send_message.message_body: {message_body}')
+        with tracing.span('send_message', transport=self._metrics_transport):
+            return self._parse_receipt_response(
+                self._call(*self._message_args(recipient, message_body, quote_timestamp, attachments))
+            )
+
+    def _receipt_args(self, message, receipt_type):
+        """Return command and its arguments for send receipt"""
+        ac = message.get_source_account()
+        ts = message.get_timestamp()
+        return self._cmd_send_receipt, [
+            ac, self._cmd_send_receipt_param_timestamp, ts, self._cmd_send_receipt_param_type, receipt_type
+        ]
+
+    def _reaction_args(self, message, emoji):
+        """Return command and its arguments for send reaction"""
+        ac = message.get_source_account()
+        ts = message.get_timestamp()
+        return self._cmd_send_reaction, [
+            ac,
+            self._cmd_send_reaction_param_author,
+            ac,
+            self._cmd_send_reaction_param_timestamp,
+            ts,
+            self._cmd_send_reaction_param_emoji,
+            emoji
+        ]
+
+    def _message_args(self, recipient, message_body, quote_timestamp, attachments):
+        """Return command and its arguments for send message"""
         extra_args = [recipient, self._cmd_send_message_param_message, message_body]
         if quote_timestamp is not None:
             extra_args += [
@@ -94,8 +163,7 @@ class SignalHandler:
             ]
         for a in attachments:
             extra_args += [self._cmd_send_message_param_attachment, a]
-
-        return self._parse_receipt_response(self._call(self._cmd_send_message, extra_args))
+        return self._cmd_send_message, extra_args
 
     def parse_message(self, output_line):
         return self._parse_messages([output_line])
@@ -107,40 +175,103 @@ class SignalHandler:
             extra_args[i] = str(extra_args[i])
         args = self._signal_cmd + [command] + extra_args
         logging.info(f'Call {args}')
-        result = subprocess.run(args, capture_output=True)
+        with metrics.timer('signal_call_seconds', command=command, transport=self._metrics_transport):
+            result = subprocess.run(args, capture_output=True)
         if result.returncode != 0:
+            metrics.inc('signal_call_errors', command=command, transport=self._metrics_transport)
             logging.error(f'signal-cli failed with RC={result.returncode}')
             logging.error(f'stderr: {result.stderr}')
+            if result.returncode in self._transient_return_codes:
+                raise SignalTransientError(f'Run signal-cli failed with RC={result.returncode}')
             raise RuntimeError('Run signal-cli failed')
 
         logging.debug(f'result.stdout: {result.stdout}')
         return result.stdout.splitlines()
 
     def _parse_messages(self, output_lines):
-        """Parse received messages and pack them into message class"""
+        """Parse received messages and pack them into message class
+
+            Lines without dataMessage (receipts, typing, sync messages) are dropped before json parsing.
+        """
         new_messages = []
 
-        for ot in output_lines:
-            if self._is_already_decoded:
-                line = ot
-            else:
-                line = ot.decode(self._default_encoding)
-            logging.info(f'Parse new message')
+        for line in output_lines:
+            if not self._is_data_message_line(line):
+                logging.debug('Not a dataMessage. Ignoring')
+                metrics.inc('signal_envelopes', type='filtered')
+                metrics.mark_event('envelope_received')
+                continue
             logging.debug(f'_parse_messages.message_str: {line}')
-            j = json.loads(line)
-            if 'receiptMessage' in j['envelope']:
-                logging.info('This is receiptMessage. Ignoring')
-            elif 'syncMessage' in j['envelope']:
-                logging.info('This is syncMessage. Ignoring')
-            elif 'typingMessage' in j['envelope']:
-                logging.info('This is typingMessage. Ignoring')
-            elif 'dataMessage' in j['envelope']:
-                new_messages.append(SignalMessage(j))
-            else:
-                logging.warning('Message type unknown')
+            m = self._parse_message_json(_json_loads(line))
+            if m is not None:
+                new_messages.append(m)
 
         return new_messages
 
+    def _is_data_message_line(self, line):
+        """Cheap check (without json parsing) if line can contain dataMessage envelope"""
+        if isinstance(line, bytes):
+            return self._data_message_key_bytes in line
+        return self._data_message_key in line
+
+    def _parse_message_json(self, j):
+        """Pack already decoded message into message class. Return None if message is ignored"""
+        parse_start = tracing.now()
+        envelope = j['envelope']
+        metrics.mark_event('envelope_received')
+        if 'dataMessage' not in envelope:
+            if 'receiptMessage' in envelope:
+                logging.debug('This is receiptMessage. Ignoring')
+                metrics.inc('signal_envelopes', type='receipt')
+            elif 'syncMessage' in envelope:
+                logging.debug('This is syncMessage. Ignoring')
+                metrics.inc('signal_envelopes', type='sync')
+            elif 'typingMessage' in envelope:
+                logging.debug('This is typingMessage. Ignoring')
+                metrics.inc('signal_envelopes', type='typing')
+            else:
+                logging.warning('Message type unknown')
+                metrics.inc('signal_envelopes', type='unknown')
+            return None
+        if not self._is_allowed_sender(envelope):
+            logging.info(f'Message from not allowed user {envelope.get("source")}. Ignoring')
+            metrics.inc('signal_envelopes', type='not_allowed')
+            return None
+        logging.info('Parse new message')
+        metrics.inc('signal_envelopes', type='data')
+        metrics.mark_event('message_received')
+        m = SignalMessage(j)
+        if tracing.enabled:
+            # Trace is started when message is processed (start_message_trace) - steps before are only timed here,
+            # so message dropped before processing leaves no unfinished trace
+            m.trace_times = (tracing.get_received(parse_start), parse_start, tracing.now())
+        return m
+
+    def start_message_trace(self, message):
+        """Return root span of message trace (see tracing.activate) or None if tracing is disabled
+
+            Trace begins when data with message was read. It has steps done before processing: stream_read,
+            parse and queue (waiting for processing).
+        """
+        if message.trace_times is None or not tracing.enabled:
+            return None
+        received, parse_start, parse_end = message.trace_times
+        trace = tracing.start_trace('message', start=received, transport=self._metrics_transport,
+                                    sender=message.get_source_account(), timestamp=message.get_timestamp())
+        if received < parse_start:
+            tracing.add_span(trace, 'stream_read', received, parse_start)
+        tracing.add_span(trace, 'parse', parse_start, parse_end)
+        tracing.add_span(trace, 'queue', parse_end)
+        return trace
+
+    def _is_allowed_sender(self, envelope):
+        """Check sender against config.ALLOWED_END_USERS. Empty list allows everyone"""
+        if not self._allowed_end_users:
+            return True
+        return (envelope.get('source') in self._allowed_end_users
+                or envelope.get('sourceNumber') in self._allowed_end_users
+                or envelope.get('sourceUuid') in self._allowed_end_users)
+
     def _parse_receipt_response(self, output_lines):
         """Parse send receipt response - if success or not"""
         receipts = []
@@ -175,16 +306,106 @@ class SignalRPCHandler(SignalHandler):
     _cmd_send_message_param_quote_timestamp = 'quoteTimestamp'
     _cmd_send_message_param_quote_author = 'quoteAuthor'
 
+    _pool_size = getattr(config, 'SIGNALRPC_POOL_SIZE', 4)
+    _connect_timeout = getattr(config, 'SIGNALRPC_CONNECT_TIMEOUT', 5)
+    _read_timeout = getattr(config, 'SIGNALRPC_READ_TIMEOUT', 60)
+    _stream_read_timeout = getattr(config, 'SIGNALRPC_STREAM_READ_TIMEOUT', None)
+    _message_stream_events = ('receive', SSEParser.default_event)
+    # signal-cli jsonRPC error codes: -3 - server or IO error, -5 - rate limit
+    _transient_error_codes = (-3, -5)
+    _metrics_transport = 'rpc'
+
+    def __init__(self):
+        """Create HTTP session with keep-alive connection pool shared by all calls and message stream"""
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self._pool_size, pool_maxsize=self._pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
     def receive_new_messages(self):
         """For RPC this is not implemented"""
         logging.warning('This function should not be called for signalRPCHandler')
 
+    def open_message_stream(self, last_event_id=None):
+        """Open stream of received messages (server-sent events). Uses connection from the session pool"""
+        logging.info(f'Open message stream {config.SIGNALRPC_MESSAGE_STREAM_ENDPOINT} from event {last_event_id}')
+        r = self._session.get(config.SIGNALRPC_MESSAGE_STREAM_ENDPOINT, stream=True,
+                              headers=self._message_stream_headers(last_event_id),
+                              timeout=(self._connect_timeout, self._stream_read_timeout))
+        r.raise_for_status()
+        return r
+
+    def iter_message_stream(self, parser=None):
+        """Yield data of every received message event until server closes the stream
+
+            parser (SSEParser) keeps id of last event. Pass the same one again to continue after reconnect.
+        """
+        if parser is None:
+            parser = SSEParser()
+        r = self.open_message_stream(parser.last_event_id)
+        try:
+            for chunk in r.iter_content(chunk_size=None):
+                tracing.mark_received()
+                for e in parser.feed(chunk):
+                    data = self._get_message_event_data(e)
+                    if data is not None:
+                        yield data
+        finally:
+            r.close()
+
+    def _message_stream_headers(self, last_event_id):
+        headers = {'Accept': 'text/event-stream'}
+        if last_event_id is not None:
+            headers['Last-Event-ID'] = last_event_id
+        return headers
+
+    def _get_message_event_data(self, event):
+        """Return data of received message event. None for other events"""
+        if event.event in self._message_stream_events:
+            return event.data
+        logging.debug(f'Ignoring {event.event} event from message stream')
+        return None
+
+    def close(self):
+        """Close all pooled connections"""
+        self._session.close()
+
+    def send_receipts(self, messages, receipt_type=SignalHandler._cmd_send_receipt_default_type):
+        """Send receipt of given type for all given messages in one batch request"""
+        with tracing.span('send_receipts', transport=self._metrics_transport, count=len(messages)):
+            with self.batch() as b:
+                calls = [b.send_receipt(m, receipt_type) for m in messages]
+        return self._batch_results(calls)
+
+    def send_reactions(self, messages, emoji=SignalHandler._cmd_send_reaction_emoji_ok):
+        """Send reaction for all given messages in one batch request"""
+        with tracing.span('send_reactions', transport=self._metrics_transport, count=len(messages)):
+            with self.batch() as b:
+                calls = [b.send_reaction(m, emoji) for m in messages]
+        return self._batch_results(calls)
+
+    def send_messages(self, recipients, message_body, quote_timestamp=None, attachments=[]):
+        """Send the same message to all given recipients in one batch request"""
+        with tracing.span('send_messages', transport=self._metrics_transport, count=len(recipients)):
+            with self.batch() as b:
+                calls = [b.send_message(r, message_body, quote_timestamp, attachments) for r in recipients]
+        return self._batch_results(calls)
+
+    def batch(self):
+        """Return new batch that collects calls and sends them as one jsonRPC request. See SignalRPCBatch"""
+        return SignalRPCBatch(self)
+
     def _call(self, command, extra_args=[]):
         """Send jsonRPC request to signalcli endpoint
 
             Note: You cannot receive things this way (there is different endpoint that stream received things)
             Function will return Exception if you try
         """
+        self._send_request(command, self._build_params(command, extra_args))
+        return []
+
+    def _build_params(self, command, extra_args):
+        """Convert command line like arguments into jsonRPC params"""
 
         # Add specific keywords needed by jsonRPC
         match command:
@@ -202,26 +423,457 @@ class SignalRPCHandler(SignalHandler):
             case _:
                 logging.debug(f'Command {command} does not need anny additional keywords')
 
-        params = common.convert_list_to_dict(extra_args)
+        return common.convert_list_to_dict(extra_args)
+
+    def _batch_results(self, calls):
+        """Return calls (SignalRPCBatchCall - result or error of each) - caller can retry only failed ones"""
+        failed = [c for c in calls if c.failed()]
+        if failed:
+            logging.error(f'{len(failed)} of {len(calls)} batched calls failed. First error: {failed[0].error}')
+        return calls
+
+    def _send_request(self, command, params):
+        """Send one jsonRPC request and return its result"""
         logging.info(f'Call {command} with params {params} on {config.SIGNALRPC_POST_ENDPOINT}')
 
-        response = requests.post(config.SIGNALRPC_POST_ENDPOINT, json=request(command, params))
-        parsed = parse(response.json())
+        start = time.perf_counter()
+        try:
+            response = self._session.post(config.SIGNALRPC_POST_ENDPOINT, json=request(command, params),
+                                          timeout=(self._connect_timeout, self._read_timeout))
+            response_json = response.json()
+        except requests.RequestException as e:
+            logging.error(f'Access API {command} failed: {e}')
+            metrics.inc('signal_call_errors', command=command, transport=self._metrics_transport)
+            raise SignalTransientError(f'Access API {command} failed: {e}')
+        finally:
+            metrics.observe('signal_call_seconds', time.perf_counter() - start, command=command,
+                            transport=self._metrics_transport)
+        logging.info(f'Call {command} took {(time.perf_counter() - start) * 1000:.1f} ms')
+        return self._parse_rpc_response(command, response_json)
+
+    def _send_batch(self, requests_list):
+        """Send list of jsonRPC requests as one batch. Return dict request id -> response"""
+        logging.info(f'Call batch of {len(requests_list)} requests on {config.SIGNALRPC_POST_ENDPOINT}')
+
+        start = time.perf_counter()
+        try:
+            response = self._session.post(config.SIGNALRPC_POST_ENDPOINT, json=requests_list,
+                                          timeout=(self._connect_timeout, self._read_timeout))
+            responses = response.json()
+        except requests.RequestException as e:
+            logging.error(f'Batch request failed: {e}')
+            metrics.inc('signal_call_errors', command='batch', transport=self._metrics_transport)
+            return {}
+        finally:
+            metrics.observe('signal_call_seconds', time.perf_counter() - start, command='batch',
+                            transport=self._metrics_transport)
+        logging.info(f'Call batch took {(time.perf_counter() - start) * 1000:.1f} ms')
+        if not isinstance(responses, list):
+            # Whole batch was rejected - server returns single error
+            logging.error(f'Batch request rejected: {responses}')
+            return {r['id']: responses for r in requests_list}
+        return {r.get('id'): r for r in responses}
+
+    def _parse_rpc_response(self, command, response_json):
+        """Return result of jsonRPC response or raise RuntimeError (SignalTransientError) if it is an error"""
+        parsed = parse(response_json)
         if isinstance(parsed, Ok):
             logging.debug(f'Call OK. Response: {parsed.result}')
-            return []
+            return parsed.result
         else:
             logging.error(f'Access API {command} failed: {parsed.message}')
+            metrics.inc('signal_call_errors', command=command, transport=self._metrics_transport)
+            if parsed.code in self._transient_error_codes:
+                raise SignalTransientError(f'Access API {command} failed: {parsed.message}')
             raise RuntimeError(f'Access API {command} failed: {parsed.message}')
 
 
+class AsyncSignalRPCHandler(SignalRPCHandler):
+    """SignalRPCHandler with asyncio API (message stream reader and jsonRPC client)
+
+        Call open() inside running event loop before use and aclose() at the end.
+        Sync methods inherited from SignalRPCHandler still work and can be used from worker threads.
+    """
+
+    def __init__(self):
+        if aiohttp is None:
+            raise RuntimeError('AsyncSignalRPCHandler needs aiohttp. Install it with: pip install aiohttp')
+        super().__init__()
+        self._async_session = None
+
+    async def open(self):
+        """Create aiohttp session with keep-alive connection pool"""
+        connector = aiohttp.TCPConnector(limit=self._pool_size)
+        timeout = aiohttp.ClientTimeout(sock_connect=self._connect_timeout, sock_read=self._read_timeout)
+        self._async_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def aclose(self):
+        """Close aiohttp session"""
+        if self._async_session is not None:
+            await self._async_session.close()
+            self._async_session = None
+
+    async def iter_message_stream(self, parser=None):
+        """Yield data of every received message event until server closes the stream
+
+            parser (SSEParser) keeps id of last event. Pass the same one again to continue after reconnect.
+        """
+        if parser is None:
+            parser = SSEParser()
+        logging.info(f'Open message stream {config.SIGNALRPC_MESSAGE_STREAM_ENDPOINT} '
+                     f'from event {parser.last_event_id}')
+        timeout = aiohttp.ClientTimeout(sock_connect=self._connect_timeout, sock_read=self._stream_read_timeout)
+        async with self._async_session.get(config.SIGNALRPC_MESSAGE_STREAM_ENDPOINT, timeout=timeout,
+                                           headers=self._message_stream_headers(parser.last_event_id)) as r:
+            r.raise_for_status()
+            async for chunk in r.content.iter_any():
+                tracing.mark_received()
+                for e in parser.feed(chunk):
+                    data = self._get_message_event_data(e)
+                    if data is not None:
+                        yield data
+
+    async def send_receipt_async(self, message, receipt_type=SignalHandler._cmd_send_receipt_default_type):
+        """Send receipt of given type for one message"""
+        logging.debug(f'send_receipt_async.message: {message}')
+        with tracing.span('send_receipt', transport=self._metrics_transport):
+            await self._call_async(*self._receipt_args(message, receipt_type))
+        return []
+
+    async def send_reaction_async(self, message, emoji=SignalHandler._cmd_send_reaction_emoji_ok):
+        """Send reaction for message"""
+        logging.debug(f'send_reaction_async.message: {message}')
+        logging.debug(f'send_reaction_async.emoji: {emoji}')
+        with tracing.span('send_reaction', transport=self._metrics_transport):
+            await self._call_async(*self._reaction_args(message, emoji))
+        return []
+
+    async def send_message_async(self, recipient, message_body, quote_timestamp=None, attachments=[]):
+        """Send a message to another user"""
+        logging.debug(f'send_message_async.recipient: {recipient}')
+        logging.debug(f'send_message_async.message_body: {message_body}')
+        with tracing.span('send_message', transport=self._metrics_transport):
+            await self._call_async(*self._message_args(recipient, message_body, quote_timestamp, attachments))
+        return []
+
+    async def _call_async(self, command, extra_args=[]):
+        """Send jsonRPC request to signalcli endpoint without blocking event loop"""
+        params = self._build_params(command, extra_args)
+        logging.info(f'Call {command} with params {params} on {config.SIGNALRPC_POST_ENDPOINT}')
+
+        start = time.perf_counter()
+        try:
+            async with self._async_session.post(config.SIGNALRPC_POST_ENDPOINT, json=request(command, params)) as r:
+                response_json = await r.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f'Access API {command} failed: {e}')
+            metrics.inc('signal_call_errors', command=command, transport=self._metrics_transport)
+            raise SignalTransientError(f'Access API {command} failed: {e}')
+        finally:
+            metrics.observe('signal_call_seconds', time.perf_counter() - start, command=command,
+                            transport=self._metrics_transport)
+        logging.info(f'Call {command} took {(time.perf_counter() - start) * 1000:.1f} ms')
+        return self._parse_rpc_response(command, response_json)
+
+
+class SignalStdioHandler(SignalRPCHandler):
+    """Perform jsonRPC calls over stdin/stdout of one long-lived `signal-cli jsonRpc` process
+
+        Every signal-cli call starts new JVM which takes seconds. This handler starts the process once
+        and multiplexes requests (matched by ids) and received messages over its pipes.
+        If the process dies it is started again on next call.
+    """
+    _cmd_json_rpc = 'jsonRpc'
+    _cmd_json_rpc_param_receive_mode = '--receive-mode'
+    _cmd_json_rpc_receive_mode_manual = 'manual'
+    _call_timeout = 60
+    _restart_delay = 1
+    _metrics_transport = 'stdio'
+
+    def __init__(self, receive_messages=True):
+        """Prepare handler. Process is started on first use
+
+            receive_messages - if False signal-cli will not receive messages (useful for scheduled jobs
+                               that should not steal messages from main bot)
+        """
+        # No super().__init__() - HTTP session is not needed. Methods using it are overridden below
+        self._receive_messages = receive_messages
+        self._process = None
+        self._process_started_at = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._received = queue.Queue()
+
+    def receive_new_messages(self, timeout=0):
+        """Return messages pushed by signal-cli since last call
+
+            Wait up to timeout seconds for the first message (None - wait forever, 0 - do not wait)
+        """
+        with self._lock:
+            self._ensure_process()
+        envelopes = []
+        try:
+            envelopes.append(self._received.get(block=timeout != 0, timeout=timeout))
+            while True:
+                envelopes.append(self._received.get_nowait())
+        except queue.Empty:
+            pass
+
+        new_messages = []
+        for received, e in envelopes:
+            logging.debug(f'receive_new_messages.envelope: {e}')
+            tracing.mark_received(received)
+            m = self._parse_message_json(e)
+            if m is not None:
+                new_messages.append(m)
+        return new_messages
+
+    def open_message_stream(self, last_event_id=None):
+        """There is no HTTP message stream - messages are pushed by process (see receive_new_messages)"""
+        raise NotImplementedError('SignalStdioHandler has no message stream. Use receive_new_messages')
+
+    def iter_message_stream(self, parser=None):
+        """There is no HTTP message stream - messages are pushed by process (see receive_new_messages)"""
+        raise NotImplementedError('SignalStdioHandler has no message stream. Use receive_new_messages')
+
+    def close(self):
+        """Stop signal-cli process"""
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                logging.info('Stop signal-cli jsonRpc process')
+                self._process.stdin.close()
+                try:
+                    self._process.wait(timeout=self._call_timeout)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+            self._process = None
+
+    def _send_request(self, command, params):
+        """Write jsonRPC request into process stdin and wait for response with the same id"""
+        req = request(command, params)
+        logging.info(f'Call {command} with params {params} via signal-cli jsonRpc')
+        with metrics.timer('signal_call_seconds', command=command, transport=self._metrics_transport):
+            call = self._submit(req)
+            responded = self._wait(req, call)
+        if not responded:
+            logging.error(f'Access API {command} failed: no response from signal-cli jsonRpc process')
+            metrics.inc('signal_call_errors', command=command, transport=self._metrics_transport)
+            raise SignalTransientError(f'Access API {command} failed: no response from signal-cli jsonRpc process')
+        return self._parse_rpc_response(command, call.response)
+
+    def _send_batch(self, requests_list):
+        """Write all requests at once and then wait for their responses. Return dict request id -> response
+
+            Requests are pipelined, so whole batch costs about one round trip to signal-cli.
+            Requests without response (timeout, process died) are mapped to None.
+        """
+        logging.info(f'Call batch of {len(requests_list)} requests via signal-cli jsonRpc')
+        with metrics.timer('signal_call_seconds', command='batch', transport=self._metrics_transport):
+            calls = []
+            for req in requests_list:
+                try:
+                    calls.append(self._submit(req))
+                except RuntimeError:
+                    calls.append(None)
+            return {
+                req['id']: call.response if call is not None and self._wait(req, call) else None
+                for req, call in zip(requests_list, calls)
+            }
+
+    def _submit(self, req):
+        """Write request to signal-cli and return _PendingCall for it"""
+        call = _PendingCall()
+        with self._lock:
+            self._ensure_process()
+            call.process = self._process
+            self._pending[req['id']] = call
+            try:
+                self._process.stdin.write(json.dumps(req) + '\n')
+                self._process.stdin.flush()
+            except OSError as e:
+                del self._pending[req['id']]
+                logging.error(f'Cannot write to signal-cli jsonRpc process: {e}')
+                raise SignalTransientError(f'Access API {req["method"]} failed: {e}')
+        return call
+
+    def _wait(self, req, call):
+        """Wait for response of submitted request. Return False if there will be no response"""
+        if not call.done.wait(self._call_timeout):
+            logging.error(f'No response for {req["method"]} in {self._call_timeout}s')
+            with self._lock:
+                self._pending.pop(req['id'], None)
+            return False
+        return call.response is not None
+
+    def _ensure_process(self):
+        """Start signal-cli process if not running. Must be called with self._lock held"""
+        if self._process is not None and self._process.poll() is None:
+            return
+        if self._process is not None:
+            logging.error(f'signal-cli jsonRpc process exited with RC={self._process.returncode}. Restarting')
+            delay = self._process_started_at + self._restart_delay - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        args = [config.SIGNAL_CMD_PATH, self._cmd_json_rpc]
+        if not self._receive_messages:
+            args += [self._cmd_json_rpc_param_receive_mode, self._cmd_json_rpc_receive_mode_manual]
+        logging.info(f'Start {args}')
+        self._process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                         encoding=self._default_encoding, bufsize=1)
+        self._process_started_at = time.monotonic()
+        threading.Thread(target=self._read_stdout, args=(self._process,), daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(self._process,), daemon=True).start()
+
+    def _read_stdout(self, process):
+        """Route responses to waiting calls and received messages into queue"""
+        for line in process.stdout:
+            try:
+                j = _json_loads(line)
+            except ValueError:
+                logging.warning(f'signal-cli jsonRpc returned not json line: {line}')
+                continue
+
+            if 'method' in j:
+                if j['method'] == 'receive':
+                    self._received.put((tracing.now(), j['params']))
+                else:
+                    logging.debug(f'Ignoring signal-cli jsonRpc notification {j["method"]}')
+                continue
+
+            with self._lock:
+                call = self._pending.pop(j.get('id'), None)
+            if call is None:
+                logging.warning(f'signal-cli jsonRpc returned response for unknown id: {line}')
+            else:
+                call.response = j
+                call.done.set()
+
+        # EOF - process has exited; fail calls that still wait for it
+        with self._lock:
+            for request_id, call in list(self._pending.items()):
+                if call.process is process:
+                    del self._pending[request_id]
+                    call.done.set()
+
+    def _read_stderr(self, process):
+        """Move signal-cli logs into our log"""
+        for line in process.stderr:
+            logging.warning(f'signal-cli: {line.rstrip()}')
+
+
+class SignalRPCBatch:
+    """Collect send calls and submit them as one jsonRPC 2.0 batch request
+
+        Use it as context manager - batch is submitted at the end of with block:
+
+            with handler.batch() as b:
+                c1 = b.send_message(recipient1, 'Hello')
+                c2 = b.send_message(recipient2, 'Hello')
+            c1.result()
+
+        Each send method returns SignalRPCBatchCall. Its result() returns jsonRPC result of this call
+        or raises RuntimeError if only this call failed.
+    """
+
+    def __init__(self, handler):
+        self._handler = handler
+        self._calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.submit()
+
+    def send_receipt(self, message, receipt_type=SignalHandler._cmd_send_receipt_default_type):
+        """Add receipt of given type for one message"""
+        return self._add(*self._handler._receipt_args(message, receipt_type))
+
+    def send_reaction(self, message, emoji=SignalHandler._cmd_send_reaction_emoji_ok):
+        """Add reaction for message"""
+        return self._add(*self._handler._reaction_args(message, emoji))
+
+    def send_message(self, recipient, message_body, quote_timestamp=None, attachments=[]):
+        """Add message to another user"""
+        return self._add(*self._handler._message_args(recipient, message_body, quote_timestamp, attachments))
+
+    def submit(self):
+        """Send all collected calls and map responses back to them"""
+        calls, self._calls = self._calls, []
+        if not calls:
+            return calls
+        if len(calls) == 1:
+            # Batch of one is just a normal request
+            c = calls[0]
+            try:
+                c.set_result(self._handler._send_request(c.command, c.request['params']))
+            except RuntimeError as e:
+                c.set_error(e)
+            return calls
+
+        responses = self._handler._send_batch([c.request for c in calls])
+        for c in calls:
+            response = responses.get(c.request['id'])
+            if response is None:
+                c.set_error(SignalTransientError(f'Access API {c.command} failed: no response in batch'))
+                continue
+            try:
+                c.set_result(self._handler._parse_rpc_response(c.command, response))
+            except RuntimeError as e:
+                c.set_error(e)
+        return calls
+
+    def _add(self, command, extra_args):
+        """Add one call to batch"""
+        c = SignalRPCBatchCall(command, request(command, self._handler._build_params(command, extra_args)))
+        self._calls.append(c)
+        return c
+
+
+class SignalRPCBatchCall:
+    """Single call inside SignalRPCBatch (also result of one item of send_receipts, send_reactions, send_messages)"""
+
+    def __init__(self, command, rpc_request):
+        self.command = command
+        self.request = rpc_request
+        self.error = None
+        self._result = None
+        self._done = False
+
+    def set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def set_error(self, error):
+        self.error = error
+        self._done = True
+
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def result(self):
+        """Return jsonRPC result of this call or raise its error"""
+        if not self._done:
+            raise RuntimeError(f'Batch with {self.command} was not submitted yet')
+        if self.error is not None:
+            raise self.error
+        return self._result
+
+
+class _PendingCall:
+    """Request sent to signal-cli jsonRpc process that waits for its response"""
+
+    def __init__(self):
+        self.process = None
+        self.done = threading.Event()
+        self.response = None
+
+
 class SignalMessage:
     """Unpacked single message"""
-    _timestamp = ''
-    _message_body = ''
-    _source_account = ''
-    _reaction = None
-    _receipt_sent = False
+    __slots__ = ('_timestamp', '_message_body', '_source_account', '_reaction', '_receipt_sent', 'trace_times')
 
     def __init__(self, message_data_in_json=None,
                  timestamp=None, source_account=None, message_body=None, reaction=None, receipt_sent=False):
@@ -230,15 +882,16 @@ class SignalMessage:
             self._source_account = message_data_in_json['envelope']['source']
             md = message_data_in_json['envelope']['dataMessage']
             self._timestamp = md['timestamp']
-            self._message_body = md['message']
-            if 'reaction' in md:
-                self._reaction = md['reaction']
+            self._message_body = md.get('message')
+            self._reaction = md.get('reaction')
         else:
             self._timestamp = timestamp
             self._source_account = source_account
             self._message_body = message_body
             self._reaction = reaction
-        logging.debug(self)
+        self._receipt_sent = receipt_sent
+        # (received, parse start, parse end) in time.time_ns() for trace of message (see tracing) or None
+        self.trace_times = None
 
     def __str__(self) -> str:
         return repr(f'SignalMessage ["source": {self._source_account}, "timestamp": {self._timestamp}, '
@@ -253,6 +906,9 @@ class SignalMessage:
     def get_message_body(self):
         return self._message_body
 
+    def get_reaction(self):
+        return self._reaction
+
     def get_sent_receipt(self) -> bool:
         return self._receipt_sent
 
@@ -2,13 +2,84 @@
 
 import config
 import common
+import metrics
+import tracing
+import webdriverPool
 
 import argparse
+import datetime
+import difflib
 import logging
+import os
 import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cronSchedule import CronSchedule, get_scheduled_jobs
 
 from librusHandler import LibrusHandler
-from signalHandler import SignalHandler, SignalRPCHandler
+from librusIndex import LibrusIndex
+from outbox import Outbox
+from signalHandler import SignalHandler, SignalRPCHandler, SignalStdioHandler
+
+
+def _configure_logging(log_config):
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        **log_config)
+
+
+def _init_librus_worker(log_config, keep_browsers):
+    """Init worker process of SignalScheduledBot._run_for_librus_accounts"""
+    _configure_logging(log_config)
+    webdriverPool.configure(keep_idle=keep_browsers)
+
+
+def _run_librus_worker(trace_context, function, ac, *args):
+    """Call function(ac, *args) in worker process as part of trace of job that submitted it"""
+    with tracing.span('librus_account', context=trace_context, account=ac['account']):
+        return function(ac, *args)
+
+
+def _librus_check_account(ac, known_ids):
+    """Return {'ids': [...], 'messages': [...]} with ids of listed messages and new ones (runs in worker process)
+
+        Only messages with id not in known_ids are opened. If account was never synced (known_ids is None)
+        only unread ones are. On error messages fetched so far are returned, but ids are not, as messages
+        not fetched must not be recorded as seen.
+    """
+    logging.info(f'SignalScheduledBot - checking new messages for {ac["account"]}')
+    messages = []
+    timings = []
+    try:
+        with LibrusHandler(ac['username'], ac['password'], timings) as lh:
+            listed = lh.get_message_list()
+            if known_ids is None:
+                new = [m for m in listed if m['unread']]
+            else:
+                new = [m for m in listed if m['id'] not in known_ids]
+            logging.info(f'SignalScheduledBot - {len(new)} new of {len(listed)} listed messages for {ac["account"]}')
+            for m in new:
+                messages.append(dict(lh.get_message(m['url']), id=m['id']))
+            return {'ids': [m['id'] for m in listed], 'messages': messages, 'timings': timings}
+    except RuntimeError as e:
+        logging.error(f'SignalScheduledBot - Cannot check new messages for account {ac["account"]}', exc_info=True)
+        return {'messages': messages, 'error': repr(e), 'timings': timings,
+                'error_screenshot': LibrusHandler.get_account_error_screenshot(ac['username'])}
+
+
+def _librus_get_account_schedule(ac, next_week):
+    """Return dict with schedule picture (file), text and week of account (runs in worker process)"""
+    logging.info(f'SignalScheduledBot - get schedule for {ac["account"]}')
+    timings = []
+    try:
+        with LibrusHandler(ac['username'], ac['password'], timings) as lh:
+            return dict(lh.get_schedule_data(next_week=next_week), timings=timings)
+    except RuntimeError as e:
+        logging.error(f'SignalScheduledBot - Cannot check schedule for account {ac["account"]}', exc_info=True)
+        return {'error': repr(e), 'timings': timings,
+                'error_screenshot': LibrusHandler.get_account_error_screenshot(ac['username'])}
 
 
 class SignalScheduledBot:
@@ -17,77 +88,240 @@ class SignalScheduledBot:
     _log_filename = 'signalScheduledBot.log'
     _log_default_level = logging.INFO
     _log_default_encoding = 'utf8'
+    _flush_timeout = getattr(config, 'OUTBOX_FLUSH_TIMEOUT', 600)
+    _librus_max_browsers = getattr(config, 'LIBRUS_MAX_BROWSERS', 3)
+    _librus_index_db = getattr(config, 'LIBRUS_INDEX_DB', 'librusIndex.sqlite')
+    _librus_index_retention_days = getattr(config, 'LIBRUS_INDEX_RETENTION_DAYS', 30)
+    _schedule_max_changes_lines = 20
+    _daemon_max_sleep = 60
+    # /health reports daemon as stalled when its loop (sleep or job) did not come round for this long
+    _health_loop_max_age = getattr(config, 'HEALTH_DAEMON_LOOP_MAX_AGE', 3600)
+    # Daemon runs next to signalBot - it needs other port than METRICS_PORT
+    _metrics_port = getattr(config, 'METRICS_DAEMON_PORT', None)
+    # Jobs of daemon mode - option of this script: (method, arguments)
+    _daemon_actions = {
+        '--unread_messages': ('librus_check_new_messages', {}),
+        '--this_week_schedule': ('librus_get_schedule', {}),
+        '--next_week_schedule': ('librus_get_schedule', {'next_week': True}),
+    }
 
     def __init__(self, filename=_log_filename, encoding=_log_default_encoding, level=_log_default_level):
         """Init logging, signal handler etc."""
-        logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
-                            datefmt='%Y-%m-%d %H:%M:%S',
-                            filename=filename,
-                            encoding=encoding,
-                            level=level)
+        self._log_config = {'filename': filename, 'encoding': encoding, 'level': level}
+        _configure_logging(self._log_config)
         self._sh = SignalHandler()
+        self._setup()
+
+    def _setup(self):
+        """Init parts shared by all bot versions"""
+        self._outbox = Outbox(self._sh)
+        self._librus_index = LibrusIndex(self._librus_index_db, retention_days=self._librus_index_retention_days)
+        self._librus_executor = None
+        # Workers keep browsers between jobs only in daemon mode (see run_daemon)
+        self._keep_browsers = False
+
+    def close(self):
+        """Stop worker processes (and their browsers)"""
+        if self._librus_executor is not None:
+            self._librus_executor.shutdown()
+            self._librus_executor = None
+        self._librus_index.close()
+
+    def run_daemon(self, jobs):
+        """Run jobs - list of (cron expression, option of this script) - forever in this process
+
+            Jobs run one by one, so account is never handled by two jobs at once. Jobs that are due at the same
+            time (or got due while other job was running) are merged - each option runs once. Worker processes
+            with their logged browsers are kept between jobs, so jobs do not pay for start and login.
+        """
+        schedules = [(CronSchedule(expression), option) for expression, option in jobs]
+        self._keep_browsers = True
+        metrics.set_gauge('queue_depth', self._outbox.get_depth, queue='outbox')
+        if self._metrics_port is not None:
+            metrics.start_server(self._metrics_port)
+        for _, option in schedules:
+            if option not in self._daemon_actions:
+                raise ValueError(f'SignalScheduledBot - unknown job {option}')
+        now = datetime.datetime.now()
+        next_runs = [cs.get_next(now) for cs, _ in schedules]
+        heartbeat = metrics.add_heartbeat_check('job_loop', self._health_loop_max_age)
+        logging.info(f'SignalScheduledBot - daemon started with {len(schedules)} jobs')
+
+        while True:
+            heartbeat.beat()
+            now = datetime.datetime.now()
+            due = [i for i, t in enumerate(next_runs) if t <= now]
+            if not due:
+                # Sleep in steps - wall clock may change (DST, suspend)
+                time.sleep(min(self._daemon_max_sleep, (min(next_runs) - now).total_seconds()))
+                continue
+
+            for option in dict.fromkeys(schedules[i][1] for i in due):
+                self._run_daemon_job(option)
+            now = datetime.datetime.now()
+            for i in due:
+                next_runs[i] = schedules[i][0].get_next(now)
+
+    def _run_daemon_job(self, option):
+        method, kwargs = self._daemon_actions[option]
+        logging.info(f'SignalScheduledBot - run job {option}')
+        try:
+            with metrics.timer('job_seconds', job=option), tracing.span('job', job=option):
+                getattr(self, method)(**kwargs)
+            metrics.mark_event(f'job_{option.lstrip("-")}')
+        except Exception as e:
+            metrics.inc('job_errors', job=option)
+            logging.error(f'SignalScheduledBot - job {option} failed', exc_info=True)
+            self._send_error_message(f'SignalScheduledBot - job {option} failed: {e!r}')
+
+    def flush_messages(self):
+        """Wait until all queued messages are sent"""
+        if not self._outbox.flush(self._flush_timeout):
+            logging.error(f'SignalScheduledBot - {self._outbox.get_depth()} messages not sent in '
+                          f'{self._flush_timeout}s')
 
     def librus_check_new_messages(self):
-        """Check for unread messages in librusSynergia page"""
-        accounts = config.LIBRUS_USERS
-        for ac in accounts:
+        """Check for new messages in librusSynergia page and send them (also ones not delivered before)"""
+        deliveries = []
+
+        def get_args(ac):
+            return (self._librus_index.get_message_ids(ac['username']),)
+
+        for ac, result in self._run_for_librus_accounts(_librus_check_account, get_args):
             ac_name = ac['account']
             ac_user = ac['username']
-            ac_pass = ac['password']
-            try:
-                logging.info(f'SignalScheduledBot - checking unread messages for {ac_name}')
-                with LibrusHandler(ac_user, ac_pass) as lh:
-                    messages = lh.get_unread_messages()
-                    if messages is not None and len(messages) > 0:
-                        self._send_unread_messages_to_librus_subscribers(messages, ac_name)
-                    else:
-                        logging.info(f'SignalScheduledBot - No new messages for account {ac_name}')
-            except RuntimeError as re:
-                logging.error(f'SignalScheduledBot - Cannot check new messages for account {ac_name}', exc_info=True)
-                self._send_error_message(f'SignalScheduledBot - Cannot check new messages for account {ac_name}',
-                                         attachments=[lh.get_error_screenshot()])
-                self._send_message_to_librus_subscribers(f'Cannot check new messages for account {ac_name}\n'
-                                                         'Please do it manually')
-
-    def librus_get_schedule(self, next_week=False):
-        """Get schedule for given accounts. This week (default) lub next one"""
-        accounts = config.LIBRUS_USERS
-        for ac in accounts:
+            for m in result.get('messages', []):
+                self._librus_index.add_message(ac_user, m, config.LIBRUS_SUBSCRIBERS)
+            if 'ids' in result:
+                self._librus_index.add_seen(ac_user, result['ids'])
+                self._librus_index.prune(ac_user, result['ids'])
+            if 'error' in result:
+                self._send_librus_error(f'Cannot check new messages for account {ac_name}', result)
+
+            pending = self._librus_index.get_pending_deliveries(ac_user, config.LIBRUS_SUBSCRIBERS)
+            if pending:
+                for message, subscriber, item in self._send_unread_messages_to_librus_subscribers(pending, ac_name):
+                    deliveries.append((ac_user, message['id'], subscriber, item))
+            else:
+                logging.info(f'SignalScheduledBot - No new messages for account {ac_name}')
+
+        # One wait for all - items not sent in time stay pending and are sent again in next run
+        self.flush_messages()
+        for ac_user, message_id, subscriber, item in deliveries:
+            if item.wait(0):
+                self._librus_index.mark_delivered(ac_user, message_id, subscriber)
+
+    def librus_get_schedule(self, next_week=False, force=False):
+        """Get schedule for given accounts. This week (default) lub next one
+
+            Schedule is sent only if it changed since it was sent last time (with summary of changes),
+            unless force is set.
+        """
+        sent = []
+        for ac, result in self._run_for_librus_accounts(_librus_get_account_schedule, lambda ac: (next_week,)):
             ac_name = ac['account']
             ac_user = ac['username']
-            ac_pass = ac['password']
+            if 'error' in result:
+                self._send_librus_error(f'Cannot check schedule for account {ac_name}', result)
+                continue
+            if not force and not self._librus_index.is_schedule_changed(ac_user, result['week'], result['text']):
+                logging.info(f'SignalScheduledBot - Schedule for {ac_name} ({result["week"]}) not changed')
+                continue
+
+            message_body = f'Schedule for {ac_name}'
+            if next_week:
+                message_body += ' for next week'
+            previous = self._librus_index.get_schedule(ac_user, result['week'])
+            if previous is not None and previous != result['text']:
+                message_body += f' changed:\n{self._get_schedule_changes(previous, result["text"])}'
+            items = self._send_message_to_librus_subscribers(message_body, attachments=[result['file']])
+            sent.append((ac_user, result, items))
+
+        self.flush_messages()
+        for ac_user, result, items in sent:
+            # Remember schedule only if everybody got it - otherwise it is sent again next time
+            if all(i.wait(0) for i in items):
+                self._librus_index.set_schedule(ac_user, result['week'], result['text'])
+
+    def _get_schedule_changes(self, previous, current):
+        """Return short summary of changed schedule lines"""
+        changes = [line for line in difflib.unified_diff(previous.splitlines(), current.splitlines(), n=0, lineterm='')
+                   if line[:1] in '+-' and not line.startswith(('+++', '---'))]
+        if len(changes) > self._schedule_max_changes_lines:
+            skipped = len(changes) - self._schedule_max_changes_lines
+            changes = changes[:self._schedule_max_changes_lines] + [f'... and {skipped} more']
+        return '\n'.join(changes)
+
+    def _run_for_librus_accounts(self, function, get_args=lambda ac: ()):
+        """Call function(account, *get_args(account)) for all accounts in parallel processes (each has own browser)
+
+            Yield (account, result) in order of config.LIBRUS_USERS, no matter which one finished first.
+            Exceptions are returned as {'error': ...} result, so one account does not break others.
+            Timings of Librus steps measured in worker process (result['timings']) are added to metrics.
+        """
+        accounts = config.LIBRUS_USERS
+        executor = self._get_librus_executor()
+        trace_context = tracing.get_context()
+        futures = [executor.submit(_run_librus_worker, trace_context, function, ac, *get_args(ac)) for ac in accounts]
+        for ac, future in zip(accounts, futures):
             try:
-                logging.info(f'SignalScheduledBot - get schedule for {ac_name}')
-                with LibrusHandler(ac_user, ac_pass) as lh:
-                    message_body = f'Schedule for {ac_name}'
-                    if next_week:
-                        message_body += ' for next week'
-                    schedule_file = lh.get_schedule(next_week=next_week)
-                    self._send_message_to_librus_subscribers(message_body, attachments=[schedule_file])
-            except RuntimeError:
-                logging.error(f'SignalScheduledBot - Cannot check schedule for account {ac_name}', exc_info=True)
-                self._send_error_message(f'SignalScheduledBot - Cannot check schedule for account {ac_name}',
-                                         attachments=[lh.get_error_screenshot()])
-                self._send_message_to_librus_subscribers(f'Cannot check schedule for account {ac_name}\n'
-                                                         'Please do it manually')
-
-    def _send_unread_messages_to_librus_subscribers(self, messages, account):
-        """Send unread messages to subscribers"""
-        mn = len(messages)
-        logging.info(f'SignalScheduledBot - Found {mn} messages')
-        for i in range(0, mn):
+                result = future.result()
+                for phase, seconds in result.pop('timings', []):
+                    metrics.observe('librus_phase_seconds', seconds, phase=phase)
+                if 'error' in result:
+                    metrics.inc('librus_errors')
+                yield ac, result
+            except Exception as e:
+                metrics.inc('librus_errors')
+                logging.error(f'SignalScheduledBot - Librus worker failed for account {ac["account"]}',
+                              exc_info=True)
+                if isinstance(e, BrokenProcessPool) and executor is self._librus_executor:
+                    # Worker process died - start new ones next time
+                    self._librus_executor = None
+                    executor.shutdown(wait=False)
+                yield ac, {'error': repr(e)}
+
+    def _get_librus_executor(self):
+        """Return pool of worker processes. It is kept, so workers (and their warm browsers) are reused
+
+            Single run (from cron) has no next job - browsers are kept only if worker handles many accounts.
+        """
+        if self._librus_executor is None:
+            workers = max(1, min(self._librus_max_browsers, len(config.LIBRUS_USERS)))
+            keep_browsers = self._keep_browsers or len(config.LIBRUS_USERS) > workers
+            self._librus_executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_librus_worker,
+                                                        initargs=(self._log_config, keep_browsers))
+        return self._librus_executor
+
+    def _send_librus_error(self, message, result):
+        """Inform admins (with screenshot if there is one) and subscribers that account was not checked"""
+        screenshot = result.get('error_screenshot')
+        attachments = [screenshot] if screenshot is not None and os.path.exists(screenshot) else []
+        self._send_error_message(f'SignalScheduledBot - {message}\n{result["error"]}', attachments=attachments)
+        self._send_message_to_librus_subscribers(f'{message}\nPlease do it manually')
+
+    def _send_unread_messages_to_librus_subscribers(self, deliveries, account):
+        """Send messages to subscribers. Return list of (message, subscriber, OutboxItem)
+
+            deliveries - list of (message, subscriber)
+        """
+        numbers = {}
+        for message, _ in deliveries:
+            numbers.setdefault(message['id'], len(numbers) + 1)
+        logging.info(f'SignalScheduledBot - Found {len(numbers)} messages')
+        sent = []
+        for message, subscriber in deliveries:
             message_body = f'New message in account {account}:\n\n'
-            message_body += f'{i + 1}. {messages[i]["sender"]}: {messages[i]["topic"]}\n\n{messages[i]["body"]}'
-            self._send_message_to_librus_subscribers(message_body)
+            message_body += f'{numbers[message["id"]]}. {message["sender"]}: {message["topic"]}\n\n{message["body"]}'
+            sent.append((message, subscriber, self._outbox.send_message(subscriber, message_body)))
+        return sent
 
     def _send_message_to_librus_subscribers(self, message_body, attachments=[]):
-        for s in config.LIBRUS_SUBSCRIBERS:
-            self._sh.send_message(s, message_body, attachments=attachments)
+        return self._outbox.send_messages(config.LIBRUS_SUBSCRIBERS, message_body, attachments=attachments)
 
     def _send_error_message(self, message_body, attachments=[]):
         """Send messages to admins about errors"""
-        for a in config.SIGNAL_ADMINS:
-            self._sh.send_message(a, message_body, attachments=attachments)
+        return self._outbox.send_messages(config.SIGNAL_ADMINS, message_body, attachments=attachments)
 
 
 class SignalScheduledRPCBot(SignalScheduledBot):
@@ -98,12 +332,25 @@ class SignalScheduledRPCBot(SignalScheduledBot):
 
     def __init__(self, filename=_log_filename, encoding=_log_default_encoding, level=_log_default_level):
         """Init logging, signal handler etc."""
-        logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
-                            datefmt='%Y-%m-%d %H:%M:%S',
-                            filename=filename,
-                            encoding=encoding,
-                            level=level)
+        self._log_config = {'filename': filename, 'encoding': encoding, 'level': level}
+        _configure_logging(self._log_config)
         self._sh = SignalRPCHandler()
+        self._setup()
+
+
+class SignalScheduledStdioBot(SignalScheduledBot):
+    """Version of SignalScheduledBot that sends all messages via one signal-cli jsonRpc process"""
+    _log_filename = 'signalScheduledStdioBot.log'
+    _log_default_level = logging.INFO
+    _log_default_encoding = 'utf8'
+
+    def __init__(self, filename=_log_filename, encoding=_log_default_encoding, level=_log_default_level):
+        """Init logging, signal handler etc."""
+        self._log_config = {'filename': filename, 'encoding': encoding, 'level': level}
+        _configure_logging(self._log_config)
+        # Do not receive - messages are handled by signalBot
+        self._sh = SignalStdioHandler(receive_messages=False)
+        self._setup()
 
 
 def main():
@@ -117,10 +364,13 @@ This BOT has two options:
 signalScheduledBOT (default) - call each command by create subprocess of signal-cli tool. This is easier to
                                to handle but is slow
 signalScheduledRPCBOT (use --rpc option to set) - uses HTTP jsonRPC endpoint to call signal-cli. Needs the
-                                                  endpoint creation before you run the script in other thread.'''
+                                                  endpoint creation before you run the script in other thread.
+signalScheduledStdioBOT (use --stdio option to set) - sends all messages via one signal-cli jsonRpc process.'''
     parser = argparse.ArgumentParser(description=desc, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('--rpc', action='store_true',
                         help='If set the signalScheduledRPCBOT version will be used (instead of signalBOT)')
+    parser.add_argument('--stdio', action='store_true',
+                        help='If set the signalScheduledStdioBOT version will be used (instead of signalBOT)')
     parser.add_argument('--unread_messages', action='store_true',
                         help='If set return unread messages for all accounts to all subscribers')
     parser.add_argument('--this_week_schedule', action='store_true',
@@ -128,24 +378,38 @@ signalScheduledRPCBOT (use --rpc option to set) - uses HTTP jsonRPC endpoint to
     parser.add_argument('--next_week_schedule', action='store_true',
                         help='If set return schedule for next week for all accounts to all subscribers. '
                              'Useful in weekends')
+    parser.add_argument('--force', action='store_true',
+                        help='If set schedule is sent even if it did not change since last time')
+    parser.add_argument('--daemon', action='store_true',
+                        help='If set run all jobs of cron.py in this process on their schedule (other job options '
+                             'are ignored)')
 
     args = parser.parse_args()
     is_rpc = args.rpc
+    is_stdio = args.stdio
     get_unread_messages = args.unread_messages
     get_this_week_schedule = args.this_week_schedule
     get_next_week_schedule = args.next_week_schedule
+    force = args.force
+    is_daemon = args.daemon
 
     if is_rpc:
         s = SignalScheduledRPCBot(level=logging.INFO)
+    elif is_stdio:
+        s = SignalScheduledStdioBot(level=logging.INFO)
     else:
         s = SignalScheduledBot(level=logging.INFO)
 
+    if is_daemon:
+        s.run_daemon(get_scheduled_jobs(is_rpc or is_stdio))
     if get_unread_messages:
         s.librus_check_new_messages()
     if get_this_week_schedule:
-        s.librus_get_schedule()
+        s.librus_get_schedule(force=force)
     if get_next_week_schedule:
-        s.librus_get_schedule(next_week=True)
+        s.librus_get_schedule(next_week=True, force=force)
+    s.flush_messages()
+    s.close()
 
 
 if __name__ == '__main__':
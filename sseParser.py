@@ -0,0 +1,76 @@
+class SSEEvent:
+    """Single server-sent event"""
+    __slots__ = ('id', 'event', 'data')
+
+    def __init__(self, event_id, event, data):
+        self.id = event_id
+        self.event = event
+        self.data = data
+
+    def __str__(self) -> str:
+        return repr(f'SSEEvent ["id": {self.id}, "event": {self.event}, "data": {self.data}]')
+
+
+class SSEParser:
+    """Incremental parser of server-sent events stream
+
+        Feed it with raw chunks of bytes as they come from the connection (chunks do not need to end on
+        line boundary) and it returns complete events. Multi-line data fields are joined, comments
+        (keep-alives) are skipped without decoding. Id of last event is kept, so the same parser can be used
+        to reconnect with Last-Event-ID header and continue where the stream ended.
+        See https://html.spec.whatwg.org/multipage/server-sent-events.html#event-stream-interpretation
+    """
+    default_event = 'message'
+
+    def __init__(self):
+        self.last_event_id = None
+        self.retry = None
+        self._buffer = b''
+        self._event = None
+        self._data = []
+
+    def feed(self, chunk):
+        """Add received bytes and return list of events completed by them"""
+        buffer = self._buffer + chunk
+        tail = b''
+        if b'\r' in buffer:
+            # \r alone is also line end. Keep trailing \r, it may be first half of \r\n
+            if buffer[-1:] == b'\r':
+                buffer, tail = buffer[:-1], b'\r'
+            buffer = buffer.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        lines = buffer.split(b'\n')
+        self._buffer = lines.pop() + tail
+
+        events = []
+        for line in lines:
+            if not line:
+                if self._data:
+                    events.append(self._dispatch())
+                else:
+                    self._event = None
+            elif line[0] != 0x3a:
+                # not a comment (line starting with ':')
+                self._process_field(line)
+        return events
+
+    def _process_field(self, line):
+        field, _, value = line.partition(b':')
+        if value[:1] == b' ':
+            value = value[1:]
+        if field == b'data':
+            self._data.append(value)
+        elif field == b'event':
+            self._event = value.decode('utf8')
+        elif field == b'id':
+            if b'\0' not in value:
+                self.last_event_id = value.decode('utf8')
+        elif field == b'retry':
+            if value.isdigit():
+                self.retry = int(value)
+
+    def _dispatch(self):
+        """Return event from collected fields and start new one"""
+        event = SSEEvent(self.last_event_id, self._event or self.default_event, b'\n'.join(self._data).decode('utf8'))
+        self._event = None
+        self._data = []
+        return event
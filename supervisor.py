@@ -0,0 +1,127 @@
+import logging
+
+import asyncio
+import random
+import threading
+import time
+
+
+class Supervisor:
+    """Run function again whenever it fails or returns, with exponential backoff and jitter
+
+        Admins are alerted only after alert_after consecutive failures (and once more when it recovers),
+        so daemon restarts or short network problems do not page anyone.
+        Failure counter is reset when target reports progress (report_progress) or runs at least
+        healthy_after seconds. Recovery message is sent on first progress after alert.
+    """
+    STATE_STARTING = 'starting'
+    STATE_RUNNING = 'running'
+    STATE_BACKOFF = 'backoff'
+
+    def __init__(self, name, alert, min_delay=1, max_delay=300, alert_after=5, healthy_after=60):
+        self._name = name
+        self._alert = alert
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._alert_after = alert_after
+        self._healthy_after = healthy_after
+        self._alerted = False
+        self.state = self.STATE_STARTING
+        self.consecutive_failures = 0
+        self.restarts = 0
+        self.last_error = None
+        self.last_progress = None
+
+    def run(self, target, clean_exit_delay=None):
+        """Call target() forever
+
+            clean_exit_delay - optional function returning seconds to wait after target returned without error
+        """
+        while True:
+            started = time.monotonic()
+            self.state = self.STATE_RUNNING
+            try:
+                target()
+            except Exception as e:
+                delay = self._on_failure(e, started)
+                if self._should_alert():
+                    self._send_alert(self._get_alert_message())
+            else:
+                delay = self._on_exit(started, clean_exit_delay)
+            self.restarts += 1
+            time.sleep(delay)
+
+    async def run_async(self, target, clean_exit_delay=None):
+        """Await target() forever. Same as run() for coroutine functions (alert is called in thread)"""
+        while True:
+            started = time.monotonic()
+            self.state = self.STATE_RUNNING
+            try:
+                await target()
+            except Exception as e:
+                delay = self._on_failure(e, started)
+                if self._should_alert():
+                    await asyncio.to_thread(self._send_alert, self._get_alert_message())
+            else:
+                delay = self._on_exit(started, clean_exit_delay)
+            self.restarts += 1
+            await asyncio.sleep(delay)
+
+    def report_progress(self):
+        """Target did useful work - it is healthy again"""
+        self.last_progress = time.time()
+        self.consecutive_failures = 0
+        if self._alerted:
+            self._alerted = False
+            # Do not block target (it may run in event loop) while message is sent
+            threading.Thread(target=self._send_alert, args=(f'{self._name} - recovered',), daemon=True).start()
+
+    def is_healthy(self) -> bool:
+        return self.state == self.STATE_RUNNING and self.consecutive_failures < self._alert_after
+
+    def get_health(self) -> dict:
+        return {
+            'name': self._name,
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'restarts': self.restarts,
+            'last_error': self.last_error,
+            'last_progress': self.last_progress,
+        }
+
+    def _on_failure(self, error, started):
+        """Count failure and return backoff delay"""
+        if time.monotonic() - started >= self._healthy_after:
+            self.consecutive_failures = 0
+        self.consecutive_failures += 1
+        self.last_error = repr(error)
+        self.state = self.STATE_BACKOFF
+        delay = min(self._max_delay, self._min_delay * 2 ** (self.consecutive_failures - 1))
+        # Jitter: wait between half and full delay, so many clients do not reconnect at the same time
+        delay *= 0.5 + random.random() / 2
+        logging.error(f'{self._name} - failed {self.consecutive_failures} time(s) in a row. '
+                      f'Restart in {delay:.1f}s', exc_info=True)
+        return delay
+
+    def _on_exit(self, started, clean_exit_delay):
+        """Target returned without error. Return delay before restart"""
+        if time.monotonic() - started >= self._healthy_after:
+            self.consecutive_failures = 0
+        self.state = self.STATE_BACKOFF
+        delay = clean_exit_delay() if clean_exit_delay is not None else self._min_delay
+        logging.warning(f'{self._name} - stopped. Restart in {delay:.1f}s')
+        return delay
+
+    def _should_alert(self) -> bool:
+        return self.consecutive_failures == self._alert_after
+
+    def _get_alert_message(self):
+        self._alerted = True
+        return (f'{self._name} - FATAL: failed {self.consecutive_failures} times in a row. '
+                f'Still trying. Last error: {self.last_error}')
+
+    def _send_alert(self, message):
+        try:
+            self._alert(message)
+        except Exception:
+            logging.error(f'{self._name} - cannot send alert', exc_info=True)
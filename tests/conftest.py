@@ -0,0 +1,20 @@
+"""Tests use config.py_template as config module (not your config.py), like benchmarks do"""
+
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+_repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _load_config():
+    spec = importlib.util.spec_from_loader(
+        'config', importlib.machinery.SourceFileLoader('config', os.path.join(_repo_dir, 'config.py_template')))
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    sys.modules['config'] = config
+
+
+sys.path.insert(0, _repo_dir)
+_load_config()
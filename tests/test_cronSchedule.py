@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+from cronSchedule import CronSchedule, SCHEDULED_JOBS, SCHEDULED_JOBS_NO_RPC, get_scheduled_jobs
+
+
+def _next(expression, after):
+    return CronSchedule(expression).get_next(datetime.datetime.fromisoformat(after)).isoformat(sep=' ')
+
+
+def test_next_minute():
+    assert _next('* * * * *', '2024-03-11 10:15:30') == '2024-03-11 10:16:00'
+
+
+def test_next_is_after_given_time():
+    assert _next('15 10 * * *', '2024-03-11 10:15:00') == '2024-03-12 10:15:00'
+
+
+def test_list_and_range():
+    assert _next('15,45 6-20 * * *', '2024-03-11 10:20:00') == '2024-03-11 10:45:00'
+    assert _next('15,45 6-20 * * *', '2024-03-11 20:50:00') == '2024-03-12 06:15:00'
+
+
+def test_step():
+    assert _next('*/20 * * * *', '2024-03-11 10:41:00') == '2024-03-11 11:00:00'
+    assert _next('10-50/20 * * * *', '2024-03-11 10:31:00') == '2024-03-11 10:50:00'
+
+
+def test_day_of_week_names():
+    # 2024-03-11 is Monday
+    assert _next('0 8 * * MON-FRI', '2024-03-15 09:00:00') == '2024-03-18 08:00:00'
+    assert _next('30 19 * * SUN', '2024-03-11 00:00:00') == '2024-03-17 19:30:00'
+
+
+def test_sunday_as_7():
+    assert _next('0 0 * * 7', '2024-03-11 00:00:00') == '2024-03-17 00:00:00'
+
+
+def test_month_names_and_year_change():
+    assert _next('0 0 1 JAN *', '2024-03-11 00:00:00') == '2025-01-01 00:00:00'
+
+
+def test_day_of_month_or_day_of_week():
+    """Both restricted - day matching any of them matches"""
+    assert _next('0 0 13 * FRI', '2024-03-11 00:00:00') == '2024-03-13 00:00:00'
+    assert _next('0 0 30 * MON', '2024-03-11 00:00:00') == '2024-03-18 00:00:00'
+    assert _next('0 0 20 * FRI', '2024-03-11 00:00:00') == '2024-03-15 00:00:00'
+
+
+def test_leap_day():
+    assert _next('0 12 29 FEB *', '2024-03-01 00:00:00') == '2028-02-29 12:00:00'
+
+
+@pytest.mark.parametrize('expression', [
+    '* * * *',
+    '* * * * * *',
+    '60 * * * *',
+    '* 24 * * *',
+    '* * 0 * *',
+    '* * * 13 *',
+    '* * * * 8',
+    '30-10 * * * *',
+    '*/0 * * * *',
+    'x * * * *',
+    '* * * FOO *',
+])
+def test_wrong_expression(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_never_matching():
+    with pytest.raises(ValueError, match='never matches'):
+        CronSchedule('0 0 31 FEB *').get_next(datetime.datetime(2024, 3, 11))
+
+
+def test_scheduled_jobs_are_valid():
+    for expression, _ in SCHEDULED_JOBS + SCHEDULED_JOBS_NO_RPC:
+        CronSchedule(expression)
+
+
+def test_get_scheduled_jobs():
+    assert get_scheduled_jobs(True) is SCHEDULED_JOBS
+    assert get_scheduled_jobs(False) is SCHEDULED_JOBS_NO_RPC
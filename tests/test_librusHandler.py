@@ -0,0 +1,18 @@
+from librusHandler import get_first_date
+
+
+def test_first_date_of_week_selector():
+    assert get_first_date('2024-03-11_2024-03-17', 'Poniedziałek 2024-03-04') == '2024-03-11'
+
+
+def test_first_date_of_schedule_text():
+    """Selector is missing - dates of days in schedule are used"""
+    assert get_first_date(None, 'Plan lekcji\nPoniedziałek\n2024-03-18\nWtorek\n2024-03-19') == '2024-03-18'
+
+
+def test_first_date_skips_invalid():
+    assert get_first_date('2024-13-01 2024-02-30 2024-02-29') == '2024-02-29'
+
+
+def test_first_date_not_found():
+    assert get_first_date('', 'Plan lekcji 12:30-13:15') is None
@@ -0,0 +1,68 @@
+import os
+import urllib.parse
+
+import pytest
+
+from librusWebClient import get_message_id, parse_message_list, parse_message_page
+
+_fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'librus')
+_messages_page = 'https://synergia.librus.pl/wiadomosci'
+
+
+def _read_fixture(name):
+    with open(os.path.join(_fixtures_dir, name), encoding='utf8') as f:
+        return f.read()
+
+
+def test_message_list():
+    messages = parse_message_list(_read_fixture('message_list.html'))
+    assert messages == [
+        {'url': '/wiadomosci/1/5/812345/f0', 'unread': True},
+        {'url': '/wiadomosci/1/5/811002/f0', 'unread': False},
+        {'url': 'https://synergia.librus.pl/wiadomosci/1/5/809871/f0', 'unread': False},
+    ]
+
+
+def test_message_list_ids():
+    """Relative and absolute links give ids the same way"""
+    messages = parse_message_list(_read_fixture('message_list.html'))
+    ids = [get_message_id(urllib.parse.urljoin(_messages_page, m['url'])) for m in messages]
+    assert ids == ['/wiadomosci/1/5/812345/f0', '/wiadomosci/1/5/811002/f0', '/wiadomosci/1/5/809871/f0']
+
+
+def test_message_list_empty():
+    assert parse_message_list(_read_fixture('message_list_empty.html')) == []
+
+
+def test_message_list_unexpected_layout():
+    with pytest.raises(RuntimeError, match='Cannot find messages list'):
+        parse_message_list(_read_fixture('message_list_unexpected.html'))
+
+
+def test_message_list_not_logged():
+    with pytest.raises(RuntimeError, match='You are not logged'):
+        parse_message_list(_read_fixture('login_page.html'))
+
+
+def test_message_page():
+    message = parse_message_page(_read_fixture('message_page.html'))
+    assert message['sender'] == 'Nowak Anna (Nauczyciel)'
+    assert message['topic'] == 'Wycieczka do Krakowa'
+    assert message['body'] == ('Szanowni Państwo,\n'
+                               'w piątek 22 marca klasa 4b jedzie na wycieczkę do Krakowa.\n'
+                               '\n'
+                               'Zbiórka o godz. 7:30 przed szkołą.\n'
+                               'Koszt: 120 zł – proszę wpłacić do środy.\n'
+                               '\n'
+                               'Pozdrawiam\n'
+                               'Anna Nowak')
+
+
+def test_message_page_unexpected_layout():
+    with pytest.raises(RuntimeError, match='Cannot find sender, topic, body'):
+        parse_message_page(_read_fixture('message_page_unexpected.html'))
+
+
+def test_message_page_not_logged():
+    with pytest.raises(RuntimeError, match='You are not logged'):
+        parse_message_page(_read_fixture('login_page.html'))
@@ -0,0 +1,89 @@
+from sseParser import SSEParser
+
+
+def _feed_all(parser, chunks):
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events
+
+
+def test_event():
+    events = SSEParser().feed(b'event: receive\ndata: {"a": 1}\n\n')
+    assert [(e.event, e.data, e.id) for e in events] == [('receive', '{"a": 1}', None)]
+
+
+def test_default_event():
+    events = SSEParser().feed(b'data: x\n\n')
+    assert events[0].event == SSEParser.default_event
+
+
+def test_chunk_split_anywhere():
+    """Every split of stream gives the same events"""
+    stream = 'id: 7\nevent: receive\ndata: zażółć\n\ndata: second\n\n'.encode('utf8')
+    expected = [('7', 'receive', 'zażółć'), ('7', 'message', 'second')]
+    for i in range(len(stream) + 1):
+        events = _feed_all(SSEParser(), [stream[:i], stream[i:]])
+        assert [(e.id, e.event, e.data) for e in events] == expected, i
+    events = _feed_all(SSEParser(), [stream[i:i + 1] for i in range(len(stream))])
+    assert [(e.id, e.event, e.data) for e in events] == expected
+
+
+def test_incomplete_event_waits():
+    parser = SSEParser()
+    assert parser.feed(b'data: x\n') == []
+    assert [e.data for e in parser.feed(b'\n')] == ['x']
+
+
+def test_crlf_and_cr_line_ends():
+    parser = SSEParser()
+    events = _feed_all(parser, [b'data: a\r', b'\n\r\n', b'data: b\r\r'])
+    assert [e.data for e in events] == ['a']
+    # Last CR may still be the first half of CRLF
+    assert [e.data for e in parser.feed(b'data: c\n\n')] == ['b', 'c']
+
+
+def test_comments_skipped():
+    events = SSEParser().feed(b': keep-alive\n\n:\ndata: x\n: comment inside\n\n')
+    assert [e.data for e in events] == ['x']
+
+
+def test_multi_line_data():
+    events = SSEParser().feed(b'data: first\ndata:second\ndata\n\n')
+    assert events[0].data == 'first\nsecond\n'
+
+
+def test_only_one_space_after_colon_removed():
+    events = SSEParser().feed(b'data:  x\n\n')
+    assert events[0].data == ' x'
+
+
+def test_event_without_data_is_not_dispatched():
+    parser = SSEParser()
+    assert parser.feed(b'event: receive\n\n') == []
+    # Event type is reset after empty event
+    assert parser.feed(b'data: x\n\n')[0].event == SSEParser.default_event
+
+
+def test_last_event_id_kept():
+    parser = SSEParser()
+    parser.feed(b'id: 1\ndata: a\n\n')
+    events = parser.feed(b'data: b\n\n')
+    assert events[0].id == '1'
+    assert parser.last_event_id == '1'
+    parser.feed(b'id: 2\n\n')
+    assert parser.last_event_id == '2'
+
+
+def test_id_with_null_ignored():
+    parser = SSEParser()
+    parser.feed(b'id: 1\n\nid: a\0b\n\n')
+    assert parser.last_event_id == '1'
+
+
+def test_retry():
+    parser = SSEParser()
+    parser.feed(b'retry: 2500\n\n')
+    assert parser.retry == 2500
+    parser.feed(b'retry: soon\n\n')
+    assert parser.retry == 2500
@@ -0,0 +1,240 @@
+import logging
+
+import config
+
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+
+
+class Span:
+    """Timed step of a trace. Use as context manager - it is current span inside with block
+
+        Spans started inside with block (also in threads and asyncio tasks started there) are its children.
+        Span is exported when it ends.
+    """
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'error', '_token')
+
+    def __init__(self, name, trace_id=None, parent_id=None, start=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id or f'{random.getrandbits(128):032x}'
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.start = start or time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_span.reset(self._token)
+        if exc_value is not None:
+            self.error = repr(exc_value)
+        self.finish()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def get_context(self):
+        """Return (trace id, span id) - pass it to other process to continue trace there"""
+        return self.trace_id, self.span_id
+
+    def finish(self, end=None):
+        if self.end is None:
+            self.end = end or time.time_ns()
+            if _exporter is not None:
+                _exporter.export(self)
+
+
+class _NoopSpan:
+    """Returned when tracing is disabled - with block costs two method calls"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def set_attribute(self, key, value):
+        pass
+
+    def get_context(self):
+        return None
+
+    def finish(self, end=None):
+        pass
+
+
+class SpanFileExporter:
+    """Append finished spans to file, one JSON per line
+
+        format 'jsonl' - flat records (trace_id, span_id, parent_id, name, start, duration_ms, attributes, error)
+        format 'otlp' - OpenTelemetry OTLP/JSON (ExportTraceServiceRequest per line), readable by
+                        OpenTelemetry Collector otlpjson file receiver
+        Every process (e.g. Librus workers) opens file on its own; lines are written with single append.
+    """
+    formats = ('jsonl', 'otlp')
+
+    def __init__(self, path, format='jsonl', service_name='signalBot'):
+        if format not in self.formats:
+            raise ValueError(f'Unknown tracing format {format}. Use one of {", ".join(self.formats)}')
+        self._path = path
+        self._format = format
+        self._service_name = service_name
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, span):
+        record = self._get_otlp_record(span) if self._format == 'otlp' else self._get_record(span)
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._file = open(self._path, 'a', encoding='utf8')
+                self._file.write(line)
+                self._file.flush()
+        except OSError:
+            logging.warning(f'Tracing - cannot write span to {self._path}', exc_info=True)
+
+    def reopen(self):
+        """Forget file of parent process (called in forked child)"""
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _get_record(self, span):
+        return {
+            'trace_id': span.trace_id,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'name': span.name,
+            'start': span.start / 1e9,
+            'duration_ms': (span.end - span.start) / 1e6,
+            'attributes': span.attributes,
+            'error': span.error,
+            'pid': os.getpid(),
+        }
+
+    def _get_otlp_record(self, span):
+        otlp_span = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            # SPAN_KIND_INTERNAL
+            'kind': 1,
+            'startTimeUnixNano': str(span.start),
+            'endTimeUnixNano': str(span.end),
+            'attributes': [self._get_otlp_attribute(k, v) for k, v in span.attributes.items()],
+            # STATUS_CODE_ERROR or STATUS_CODE_UNSET
+            'status': {'code': 2, 'message': span.error} if span.error is not None else {},
+        }
+        if span.parent_id is not None:
+            otlp_span['parentSpanId'] = span.parent_id
+        return {'resourceSpans': [{
+            'resource': {'attributes': [self._get_otlp_attribute('service.name', self._service_name),
+                                        self._get_otlp_attribute('process.pid', os.getpid())]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': [otlp_span]}],
+        }]}
+
+    def _get_otlp_attribute(self, key, value):
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+_NOOP_SPAN = _NoopSpan()
+_current_span = contextvars.ContextVar('tracing_span', default=None)
+_received_at = contextvars.ContextVar('tracing_received_at', default=None)
+_exporter = None
+enabled = False
+
+
+def configure(path, format='jsonl'):
+    """Export spans to file at path (None - disable tracing)"""
+    global _exporter, enabled
+    _exporter = SpanFileExporter(path, format) if path is not None else None
+    enabled = _exporter is not None
+
+
+def span(name, context=None, **attributes):
+    """Return span for with block. Child of current span, of context (from other process) or new trace"""
+    if not enabled:
+        return _NOOP_SPAN
+    if context is None:
+        parent = _current_span.get()
+        if parent is not None:
+            context = parent.trace_id, parent.span_id
+    trace_id, parent_id = context if context is not None else (None, None)
+    return Span(name, trace_id, parent_id, attributes=attributes)
+
+
+def start_trace(name, start=None, **attributes):
+    """Return root span of new trace that is not current yet (see activate) or None if tracing is disabled
+
+        start - time.time_ns() when it started, if it was earlier than now
+    """
+    if not enabled:
+        return None
+    return Span(name, start=start, attributes=attributes)
+
+
+def activate(root):
+    """Return root (from start_trace) for with block - it is current inside and ends at the end"""
+    return root if root is not None else _NOOP_SPAN
+
+
+def add_span(parent, name, start, end=None, **attributes):
+    """Record step that already happened (start and end are time.time_ns()) as child of parent span"""
+    if parent is None:
+        return
+    Span(name, parent.trace_id, parent.span_id, start, attributes).finish(end)
+
+
+def set_attribute(key, value):
+    """Set attribute of current span (e.g. result known only inside with block)"""
+    if enabled:
+        current = _current_span.get()
+        if current is not None:
+            current.set_attribute(key, value)
+
+
+def get_context():
+    """Return (trace id, span id) of current span or None"""
+    current = _current_span.get() if enabled else None
+    return current.get_context() if current is not None else None
+
+
+def mark_received(at=None):
+    """Remember when data (stream chunk, signal-cli output) was read. Traces of messages in it start then"""
+    if enabled:
+        _received_at.set(at or time.time_ns())
+
+
+def get_received(default=None):
+    received = _received_at.get() if enabled else None
+    return received if received is not None else default
+
+
+def now():
+    """Return current time for spans (0 when tracing is disabled, so it costs nothing)"""
+    return time.time_ns() if enabled else 0
+
+
+def _reopen_exporter():
+    if _exporter is not None:
+        _exporter.reopen()
+
+
+configure(getattr(config, 'TRACING_FILE', None), getattr(config, 'TRACING_FORMAT', 'jsonl'))
+os.register_at_fork(after_in_child=_reopen_exporter)
@@ -0,0 +1,225 @@
+import logging
+
+import common
+import config
+
+import multiprocessing.util
+import os
+import threading
+import time
+
+
+class PooledWebdriver:
+    """Browser instance owned by WebdriverPool"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.created = time.monotonic()
+        self.leases = 0
+
+
+class WebdriverPool:
+    """Keep up to size warm browsers and lease them to jobs, so they do not pay browser start each time
+
+        Browser state (cookies, cache, storage, opened windows) is reset when it is released.
+        Browser is recycled (quit and started again on next lease) when it is older than max_age seconds,
+        was leased max_leases times, uses more than max_memory_mb (with all child processes) or reset failed.
+        Pool is per process - browsers cannot be shared between processes. Use get_pool().
+        It helps only in long-lived processes (signalScheduledBot.py --daemon workers) or when process has more
+        jobs than one. With keep_idle False released browsers are quit at once - nobody would use them.
+    """
+
+    def __init__(self, size=1, max_age=3600, max_leases=20, max_memory_mb=500, keep_idle=True):
+        self._size = size
+        self._keep_idle = keep_idle
+        self._max_age = max_age
+        self._max_leases = max_leases
+        self._max_memory = max_memory_mb * 1024 * 1024
+        self._cond = threading.Condition()
+        self._idle = []
+        self._leased = {}
+        self._starting = 0
+        self._closed = False
+
+    def acquire(self, timeout=None):
+        """Return warm (or new) driver. Wait if all size browsers are leased"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('WebdriverPool is closed')
+            if not self._cond.wait_for(
+                    lambda: self._closed or self._idle or len(self._leased) + self._starting < self._size, timeout):
+                raise RuntimeError(f'WebdriverPool - no browser available in {timeout}s')
+            if self._closed:
+                raise RuntimeError('WebdriverPool is closed')
+            if self._idle:
+                pooled = self._idle.pop()
+            else:
+                pooled = None
+                self._starting += 1
+
+        if pooled is None:
+            try:
+                logging.info('WebdriverPool - start new browser')
+                pooled = PooledWebdriver(common.init_webdriver())
+            finally:
+                with self._cond:
+                    self._starting -= 1
+                    self._cond.notify_all()
+
+        with self._cond:
+            pooled.leases += 1
+            self._leased[id(pooled.driver)] = pooled
+        return pooled.driver
+
+    def release(self, driver):
+        """Return driver to pool. It is reset or recycled, so next job gets clean browser"""
+        with self._cond:
+            pooled = self._leased.pop(id(driver))
+            keep = self._keep_idle and not self._closed
+        keep = keep and self._reset(pooled) and not self._should_recycle(pooled)
+        with self._cond:
+            # Pool may be closed while browser was reset
+            if keep and not self._closed:
+                self._idle.append(pooled)
+                self._cond.notify_all()
+                return
+        self._quit(pooled)
+        with self._cond:
+            self._cond.notify_all()
+
+    def warm_up(self):
+        """Start browsers until there are size of them"""
+        drivers = []
+        try:
+            while True:
+                with self._cond:
+                    if len(self._idle) + len(self._leased) + self._starting >= self._size:
+                        break
+                drivers.append(self.acquire())
+        finally:
+            for d in drivers:
+                self.release(d)
+
+    def close(self):
+        """Quit idle browsers. Leased ones are quit when released"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for pooled in idle:
+            self._quit(pooled)
+
+    def _reset(self, pooled):
+        """Clear browser state. Return False if browser does not work"""
+        driver = pooled.driver
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            for origin in self._get_frame_origins(driver.execute_cdp_cmd('Page.getFrameTree', {})['frameTree']):
+                driver.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': origin, 'storageTypes': 'all'})
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+            driver.get('about:blank')
+            return True
+        except Exception:
+            logging.warning('WebdriverPool - cannot reset browser', exc_info=True)
+            return False
+
+    def _get_frame_origins(self, frame_tree):
+        """Return origins of all frames of page (e.g. login frame has other origin than page)"""
+        origins = set()
+        origin = frame_tree['frame'].get('securityOrigin', '')
+        if origin.startswith('http'):
+            origins.add(origin)
+        for child in frame_tree.get('childFrames', []):
+            origins |= self._get_frame_origins(child)
+        return origins
+
+    def _should_recycle(self, pooled):
+        age = time.monotonic() - pooled.created
+        if age > self._max_age:
+            logging.info(f'WebdriverPool - recycle browser after {age:.0f}s')
+            return True
+        if pooled.leases >= self._max_leases:
+            logging.info(f'WebdriverPool - recycle browser after {pooled.leases} leases')
+            return True
+        memory = self._get_memory(pooled.driver)
+        if memory > self._max_memory:
+            logging.info(f'WebdriverPool - recycle browser using {memory // (1024 * 1024)}MB')
+            return True
+        return False
+
+    def _get_memory(self, driver):
+        """Return RSS in bytes of driver process and all its children (browser, renderers). 0 if unknown"""
+        try:
+            root = driver.service.process.pid
+            children = {}
+            for pid in os.listdir('/proc'):
+                if pid.isdigit():
+                    try:
+                        with open(f'/proc/{pid}/stat') as f:
+                            # ppid is second field after ")" - process name may contain spaces
+                            ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+                    except (OSError, IndexError, ValueError):
+                        continue
+                    children.setdefault(ppid, []).append(int(pid))
+
+            memory = 0
+            pids = [root]
+            while pids:
+                pid = pids.pop()
+                pids.extend(children.get(pid, []))
+                try:
+                    with open(f'/proc/{pid}/statm') as f:
+                        memory += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+                except (OSError, IndexError, ValueError):
+                    pass
+            return memory
+        except (AttributeError, OSError):
+            return 0
+
+    def _quit(self, pooled):
+        try:
+            common.destroy_webdriver(pooled.driver)
+        except Exception:
+            logging.warning('WebdriverPool - cannot quit browser', exc_info=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_keep_idle = True
+
+
+def configure(keep_idle):
+    """Set if released browsers are kept for next jobs of this process. Call before first get_pool()"""
+    global _keep_idle
+    _keep_idle = keep_idle
+
+
+def get_pool():
+    """Return WebdriverPool of this process. Browsers are quit when process exits"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WebdriverPool(
+                size=getattr(config, 'WEBDRIVER_POOL_SIZE', 1),
+                max_age=getattr(config, 'WEBDRIVER_MAX_AGE', 3600),
+                max_leases=getattr(config, 'WEBDRIVER_MAX_LEASES', 20),
+                max_memory_mb=getattr(config, 'WEBDRIVER_MAX_MEMORY_MB', 500),
+                keep_idle=_keep_idle,
+            )
+            # Unlike atexit, it is called also in multiprocessing worker processes
+            multiprocessing.util.Finalize(None, _pool.close, exitpriority=10)
+        return _pool
+
+
+def _forget_pool():
+    """Forked child must not use browsers of parent - it starts own pool"""
+    global _pool
+    _pool = None
+
+
+os.register_at_fork(after_in_child=_forget_pool)
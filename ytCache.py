@@ -0,0 +1,178 @@
+import logging
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from pytube import extract
+
+
+class YouTubeCache:
+    """Cache of downloaded YouTube files keyed by video id and itag
+
+        Every entry is kept in its own directory <video_id>_<itag> inside location, so public link to
+        it is always the same. Index file keeps filename, size and last use time of every entry.
+        Least recently used entries are removed when cache is bigger than max_size_mb; entries not used
+        for ttl_days are removed as well (at start, when found on lookup and every _evict_interval).
+        Concurrent requests for the same video wait for one download instead of downloading it again.
+        Last use time of cache hits is saved to index at most every _save_interval seconds.
+    """
+    _index_filename = '.yt_cache_index.json'
+    _save_interval = 60
+    _evict_interval = 60 * 60
+    # Directories of downloads made before cache existed (one uuid4 directory per download)
+    _legacy_dir_pattern = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+    # Cache entry directory: <video_id>_<itag>
+    _entry_dir_pattern = re.compile(r'^[\w-]{11}_\d+$')
+
+    def __init__(self, location, max_size_mb=2048, ttl_days=30):
+        self._location = location
+        self._max_size = max_size_mb * 1024 * 1024
+        self._ttl = ttl_days * 24 * 60 * 60
+        self._lock = threading.Lock()
+        self._in_progress = {}
+        self._index = self._load_index()
+        self._saved_at = 0
+        self._evicted_at = 0
+        self._dirty = False
+        if os.path.isdir(location):
+            with self._lock:
+                self._remove_stray_dirs()
+                self._evict()
+                self._save_index()
+
+    def lookup(self, url, itag):
+        """Return (dirname, filename) of cached file or None if it is not in cache"""
+        key = self._get_key(url, itag)
+        with self._lock:
+            return self._touch(key)
+
+    def get(self, url, itag, download):
+        """Return (dirname, filename) of cached file. Download it if needed
+
+            download(url, itag, os_path) must save file into os_path directory and return its filename
+        """
+        key = self._get_key(url, itag)
+        while True:
+            with self._lock:
+                cached = self._touch(key)
+                if cached is not None:
+                    logging.info(f'YouTubeCache - hit {key}')
+                    return cached
+                in_progress = self._in_progress.get(key)
+                if in_progress is None:
+                    in_progress = self._in_progress[key] = threading.Event()
+                    break
+            # Someone else downloads the same file. Check cache again when done (or try ourselves if failed)
+            logging.info(f'YouTubeCache - {key} is being downloaded already. Waiting')
+            in_progress.wait()
+
+        try:
+            logging.info(f'YouTubeCache - miss {key}. Downloading')
+            os_path = os.path.join(self._location, key)
+            if os.path.isdir(os_path):
+                shutil.rmtree(os_path)
+            os.mkdir(os_path)
+            filename = download(url, itag, os_path)
+            size = os.path.getsize(os.path.join(os_path, filename))
+            with self._lock:
+                self._index[key] = {'filename': filename, 'size': size, 'last_used': time.time()}
+                self._evict(keep=key)
+                self._save_index()
+            return key, filename
+        finally:
+            with self._lock:
+                del self._in_progress[key]
+            in_progress.set()
+
+    def _get_key(self, url, itag):
+        """Return cache key for given url. Raise RuntimeError if url does not contain video id"""
+        try:
+            return f'{extract.video_id(url)}_{itag}'
+        except Exception as e:
+            raise RuntimeError(f'Cannot find video id in {url}') from e
+
+    def _touch(self, key):
+        """Mark entry as used now and return (dirname, filename) or None. Must be called with self._lock held"""
+        now = time.time()
+        if now - self._evicted_at > self._evict_interval:
+            self._evict()
+            self._dirty = True
+        entry = self._index.get(key)
+        if entry is None:
+            self._save_index_if_due(now)
+            return None
+        if now - entry['last_used'] > self._ttl:
+            self._remove(key, 'expired')
+            self._save_index()
+            return None
+        if not os.path.isfile(os.path.join(self._location, key, entry['filename'])):
+            logging.warning(f'YouTubeCache - file of {key} disappeared. Removing from index')
+            del self._index[key]
+            self._save_index()
+            return None
+        entry['last_used'] = now
+        self._dirty = True
+        self._save_index_if_due(now)
+        return key, entry['filename']
+
+    def _evict(self, keep=None):
+        """Remove expired entries and least recently used ones above size limit. Call with self._lock held"""
+        now = time.time()
+        self._evicted_at = now
+        for key in [k for k, e in self._index.items() if k != keep and now - e['last_used'] > self._ttl]:
+            self._remove(key, 'expired')
+
+        total = sum(e['size'] for e in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_used']):
+            if total <= self._max_size:
+                break
+            if key == keep:
+                continue
+            total -= self._index[key]['size']
+            self._remove(key, 'cache size limit')
+
+    def _remove(self, key, reason):
+        """Delete entry files and remove it from index"""
+        logging.info(f'YouTubeCache - remove {key} ({reason})')
+        shutil.rmtree(os.path.join(self._location, key), ignore_errors=True)
+        del self._index[key]
+
+    def _remove_stray_dirs(self):
+        """Delete entry directories missing in index and old downloads (uuid4 directories) older than ttl"""
+        now = time.time()
+        for name in os.listdir(self._location):
+            path = os.path.join(self._location, name)
+            if not os.path.isdir(path) or name in self._index:
+                continue
+            if self._entry_dir_pattern.match(name):
+                logging.info(f'YouTubeCache - remove {name} (not in index)')
+                shutil.rmtree(path, ignore_errors=True)
+            elif self._legacy_dir_pattern.match(name) and now - os.path.getmtime(path) > self._ttl:
+                logging.info(f'YouTubeCache - remove {name} (old download, expired)')
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self._location, self._index_filename), encoding='utf8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.warning('YouTubeCache - index file is broken. Starting with empty cache')
+            return {}
+
+    def _save_index_if_due(self, now):
+        if self._dirty and now - self._saved_at > self._save_interval:
+            self._save_index()
+
+    def _save_index(self):
+        path = os.path.join(self._location, self._index_filename)
+        with open(path + '.tmp', 'w', encoding='utf8') as f:
+            json.dump(self._index, f)
+        os.replace(path + '.tmp', path)
+        self._saved_at = time.time()
+        self._dirty = False